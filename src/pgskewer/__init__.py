@@ -6,26 +6,39 @@ result storage, cancellation support, crash protection, and pipeline execution.
 """
 
 import asyncio
+import collections
+import contextlib
+import dataclasses as dc
 import datetime as dt
 import functools
+import graphlib
+import hashlib
 import inspect
-import json
 import os
+import random
 import sys
 import tempfile
+import time
 import traceback
 import typing as t
+import uuid
 from pathlib import Path
 
 import asyncpg
 import dill
 from edwh_uuid7 import uuid7
 from pgqueuer import PgQueuer, executors
-from pgqueuer.completion import CompletionWatcher
-from pgqueuer.db import AsyncpgDriver
+from pgqueuer.db import AsyncpgDriver, AsyncpgPoolDriver, Driver
 from pgqueuer.models import JOB_STATUS, Job
+from pgqueuer.queries import Queries
 
-from .helpers import safe_dill, safe_json
+from .codecs import dumps_json, encode_payload, loads_json, payload_codec
+from .completion import CompletionHub, ResultHub
+from .helpers import UNIQUE_KEY_HEADER, EnqueuedJob, queue_job_async, safe_json
+from .helpers import safe_dill as safe_dill  # re-export
+from .logs import LogWriter
+from .memoize import Memoize
+from .results import COMPRESSION, BlobPointer, ResultWriter, is_blob
 
 type AsyncTask = t.Callable[[Job], t.Awaitable[t.Any]]
 # type AsyncTask = executors.AsyncEntrypoint
@@ -33,7 +46,7 @@ type AsyncTask = t.Callable[[Job], t.Awaitable[t.Any]]
 
 # Wrap each job with the substep name and job id, using a helper coroutine
 async def named_future(
-    substep: str, job_id: int, fut: asyncio.Future[JOB_STATUS]
+    substep: str, job_id: int, fut: t.Awaitable[JOB_STATUS]
 ) -> tuple[str, int, JOB_STATUS | Exception]:
     """
     Associate a substep name and job ID with a future for tracking purposes.
@@ -82,8 +95,34 @@ class TaskResult(t.TypedDict):
 
 
 class PipelineMeta(t.TypedDict):
+    """
+    Information about the pipeline a substep is running in.
+
+    Attributes:
+        name: The entrypoint name of the pipeline.
+        steps: The stages of the pipeline. For dependency-driven pipelines, these are the
+            generations of the graph (every step only depends on steps in earlier generations).
+        depends_on: Only for dependency-driven pipelines: the dependencies of each step.
+    """
+
     name: str
     steps: list[str | list[str]]
+    depends_on: t.NotRequired[dict[str, list[str]]]
+
+
+class MapItem(t.TypedDict):
+    """
+    The part of the input a single job of a map step has to process.
+
+    Attributes:
+        index: Position of this item (or chunk) in the mapped-over list.
+        item: The element to process (for map steps without `chunk_size`).
+        items: The elements to process (for map steps with a `chunk_size`).
+    """
+
+    index: int
+    item: t.NotRequired[t.Any]
+    items: t.NotRequired[list[t.Any]]
 
 
 class PipelinePayload(t.TypedDict):
@@ -93,11 +132,17 @@ class PipelinePayload(t.TypedDict):
     Attributes:
         initial: The original input data that started the pipeline.
         tasks: Dictionary mapping task names to their individual results.
+        refs: Only for pipelines that pass results by reference: the job id of every finished task
+            (or the list of job ids, for map steps).
+            Substeps receive these instead of `tasks` and can load results with `ImprovedQueuer.resolve_tasks()`.
+        map: Only for jobs of a map step: the element(s) this job should process.
     """
 
     initial: t.Any
     pipeline: PipelineMeta
     tasks: dict[str, TaskResult]
+    refs: t.NotRequired[dict[str, int | list[int]]]
+    map: t.NotRequired[MapItem]
 
 
 class SkewerException(Exception): ...
@@ -106,19 +151,19 @@ class SkewerException(Exception): ...
 class SubstepFailed(SkewerException): ...
 
 
-def _extract_initial_payload(payload: t.Any) -> tuple[t.Any, dict[str, TaskResult]]:
+def _extract_initial_payload(payload: t.Any) -> tuple[t.Any, dict[str, TaskResult], dict[str, int | list[int]]]:
     """
     Preserve the original root input when a pipeline step invokes another pipeline.
 
     Nested pipelines receive the parent pipeline payload (`initial`, `pipeline`, `tasks`).
     For those cases, this returns the parent's `initial` value and carries forward
-    already-completed parent tasks.
+    already-completed parent tasks (and the references to them, if any).
     """
     if payload is None:
-        return None, {}
+        return None, {}, {}
 
     if not isinstance(payload, dict):
-        return payload, {}
+        return payload, {}, {}
 
     pipeline_meta = payload.get("pipeline")
     tasks = payload.get("tasks", {})
@@ -130,9 +175,50 @@ def _extract_initial_payload(payload: t.Any) -> tuple[t.Any, dict[str, TaskResul
         and "steps" in pipeline_meta
         and isinstance(tasks, dict)
     ):
-        return payload["initial"], dict(tasks)
+        return payload["initial"], dict(tasks), dict(payload.get("refs", {}))
+
+    return payload, {}, {}
+
+
+def _substep_payload(results: PipelinePayload) -> PipelinePayload:
+    """
+    Build the payload for the next substeps of a pipeline.
 
-    return payload, {}
+    When results are passed by reference, tasks that have a reference are left out.
+    """
+    if "refs" not in results:
+        return results
+
+    refs = results["refs"]
+    return results | {"tasks": {step: result for step, result in results["tasks"].items() if step not in refs}}
+
+
+def _nested_result(plan: list["PlanStep"], idx: int, results: PipelinePayload) -> TaskResult:
+    """
+    Build the result a nested pipeline job would have had, from the results of its (flattened) steps.
+
+    Like that job, it holds the tasks the nested pipeline was started with (those of the outer pipeline's steps
+    it depends on, and whatever the outer pipeline itself received), followed by the tasks of its own steps.
+    """
+    ancestors: set[int] = set()
+    todo = list(plan[idx].depends_on)
+    while todo:
+        if (dep := todo.pop()) not in ancestors:
+            ancestors.add(dep)
+            todo.extend(plan[dep].depends_on)
+
+    own = {node.entrypoint for node in plan}
+    steps = {plan[dep].entrypoint for dep in ancestors}
+    nested: PipelinePayload = {
+        "initial": results["initial"],
+        "pipeline": plan[idx].collects,
+        "tasks": {step: task for step, task in results["tasks"].items() if step in steps or step not in own},
+    }
+    if "refs" in results:
+        nested["refs"] = {step: ref for step, ref in results["refs"].items() if step in steps or step not in own}
+        nested = _substep_payload(nested)
+
+    return {"status": "successful", "ok": True, "result": nested}
 
 
 def is_async(fn: t.Callable[..., t.Awaitable[...]]) -> bool:
@@ -153,7 +239,395 @@ def is_async(fn: t.Callable[..., t.Awaitable[...]]) -> bool:
     return inspect.iscoroutinefunction(fn)
 
 
-type InputStep = str | AsyncTask | t.Sequence[str | AsyncTask] | t.Sequence[t.Sequence[str | AsyncTask]]
+type StepRef = str | AsyncTask | Step
+type DependencyGraph = t.Mapping[StepRef, StepRef | t.Sequence[StepRef]]
+type InputStep = StepRef | Group | t.Sequence[StepRef | Group] | t.Sequence[t.Sequence[StepRef]] | DependencyGraph
+
+
+@dc.dataclass(frozen=True, kw_only=True)
+class Step:
+    """
+    A pipeline step with options. Can be used anywhere a plain step (name or function) is accepted.
+
+    Attributes:
+        entrypoint: The entrypoint (name or function) to run.
+        over: Makes this a *map* step, which runs one job per element of a list instead of a single job.
+            Either a dotted path into the pipeline payload (e.g. "initial.urls" or "tasks.extract.result")
+            or a function that takes the pipeline payload and returns the list.
+        chunk_size: For map steps: run one job per `chunk_size` elements instead of one per element.
+        max_parallel: For map steps: the maximum number of its jobs that are enqueued (and not done) at the same time.
+            The others are enqueued as earlier ones complete.
+        timeout: Maximum time (in seconds, or as timedelta) a job of this step may take, counted from the
+            moment it is enqueued. Jobs that take longer are cancelled and count as failed (with a `TimeoutError`).
+        retries: How many times a failed (or timed out) job of this step is enqueued again before the pipeline fails.
+        backoff: Base delay (in seconds, or as timedelta) before a retry. The delay doubles with every attempt
+            and is randomized (between half and the full delay), so retries of many jobs don't all coincide.
+        retry_on: Only retry failures raised as one of these exceptions (classes, or class names),
+            matched by class name. Retries every failure by default.
+
+    Example:
+        >>> pgq.pipeline("extract", Step(transform, over="tasks.extract.result", chunk_size=100), "load")
+        >>> pgq.pipeline(Step("fetch", timeout=30, retries=3, retry_on=[TimeoutError, "HTTPError"]), "store")
+    """
+
+    entrypoint: str | AsyncTask = dc.field(kw_only=False)
+    over: str | t.Callable[[PipelinePayload], t.Sequence[t.Any]] | None = None
+    chunk_size: int | None = None
+    max_parallel: int | None = None
+    timeout: float | dt.timedelta | None = None
+    retries: int = 0
+    backoff: float | dt.timedelta = 1.0
+    retry_on: t.Sequence[type[BaseException] | str] = ()
+
+    def __post_init__(self):
+        for option in ("chunk_size", "max_parallel"):
+            value = getattr(self, option)
+            if value is not None and self.over is None:
+                raise ValueError(f"{option} only applies to map steps (pass `over` as well)")
+            if value is not None and value < 1:
+                raise ValueError(f"{option} must be at least 1")
+
+        if self.retries < 0:
+            raise ValueError("retries can't be negative")
+
+        # normalize, so steps stay hashable and comparable:
+        object.__setattr__(self, "timeout", _seconds(self.timeout))
+        object.__setattr__(self, "backoff", _seconds(self.backoff))
+        object.__setattr__(
+            self, "retry_on", tuple(exc if isinstance(exc, str) else exc.__name__ for exc in self.retry_on)
+        )
+
+    def retry_delay(self, attempt: int) -> dt.timedelta:
+        """
+        The (jittered, exponential) delay before attempt number `attempt` (2 for the first retry).
+        """
+        delay = self.backoff * 2 ** (attempt - 2)
+        return dt.timedelta(seconds=random.uniform(delay / 2, delay))
+
+    def should_retry(self, attempt: int, exception: str | None) -> bool:
+        """
+        Whether a job that failed at attempt number `attempt` with (the class name of) `exception` is retried.
+        """
+        return attempt <= self.retries and (not self.retry_on or exception in self.retry_on)
+
+
+def _seconds(value: float | dt.timedelta | None) -> float | None:
+    return value.total_seconds() if isinstance(value, dt.timedelta) else value
+
+
+@dc.dataclass(frozen=True)
+class Group:
+    """
+    Steps that run in parallel, like a list of steps in a sequential pipeline, but with options.
+
+    Attributes:
+        steps: The steps of the group.
+        max_parallel: The maximum number of jobs of this group (including the jobs of map steps in it)
+            that are enqueued (and not done) at the same time. The others are enqueued as earlier ones complete.
+
+    Example:
+        >>> pgq.pipeline("extract", Group(["resize", "ocr", "thumbnail", "index"], max_parallel=2), "load")
+    """
+
+    steps: t.Sequence[str | AsyncTask | Step]
+    max_parallel: int | None = None
+
+    def __post_init__(self):
+        if self.max_parallel is not None and self.max_parallel < 1:
+            raise ValueError("max_parallel must be at least 1")
+
+
+def _step_name(step: str | Step) -> str:
+    return step if isinstance(step, str) else t.cast(str, step.entrypoint)
+
+
+def _resolve_path(payload: t.Any, path: str) -> t.Any:
+    """
+    Look up a dotted path (e.g. "tasks.extract.result.0") in a (parsed) payload.
+
+    Raises:
+        LookupError: if some part of the path doesn't exist.
+    """
+    value = payload
+    for part in path.split("."):
+        if isinstance(value, t.Mapping):
+            value = value[part]
+        elif isinstance(value, t.Sequence) and part.lstrip("-").isdigit():
+            value = value[int(part)]
+        else:
+            raise KeyError(path)
+
+    return value
+
+
+def _map_result(unit_results: list[TaskResult | None]) -> TaskResult:
+    """
+    Combine the results of all jobs of a map step (in input order) into the result of the step itself.
+    """
+    return {
+        "status": "successful",
+        "ok": all(unit["ok"] for unit in unit_results if unit),
+        "result": [unit["result"] if unit else None for unit in unit_results],
+    }
+
+
+def _exception_name(task_result: TaskResult | None) -> str | None:
+    """
+    The class name of the exception a job failed with, as saved by `store_results`.
+    """
+    if not task_result or task_result["ok"] or not isinstance(task_result["result"], dict):
+        return None
+
+    exception = task_result["result"].get("exception")
+    return exception[0] if exception else None
+
+
+@dc.dataclass(frozen=True)
+class PlanStep:
+    """
+    A single node of a compiled pipeline plan.
+
+    Attributes:
+        entrypoint: The entrypoint that is enqueued for this node.
+        depends_on: Indices (into the plan) of the nodes that must finish before this one is enqueued.
+        options: The `Step` this node was defined with, if it has any options.
+        group: For nodes in a `Group` with `max_parallel`: the index of the first node of that group
+            (which identifies it) and its `max_parallel`.
+        context: For nodes of a nested pipeline that was flattened into this plan: the metadata of that
+            pipeline, passed to the node instead of the metadata of the outer pipeline.
+        collects: Marks the node that stands in for a flattened nested pipeline: it isn't enqueued,
+            but completes (with the result the nested pipeline job would have had) once all of its nodes are done.
+    """
+
+    entrypoint: str
+    depends_on: tuple[int, ...] = ()
+    options: Step | None = None
+    group: tuple[int, int] | None = None
+    context: PipelineMeta | None = None
+    collects: PipelineMeta | None = None
+
+    @property
+    def is_map(self) -> bool:
+        return self.options is not None and self.options.over is not None
+
+    def units(self, payload: PipelinePayload) -> list[MapItem | None]:
+        """
+        The jobs to enqueue for this node: a single one (None) for regular steps,
+        or one `MapItem` per element (or chunk) of the mapped-over list for map steps.
+        """
+        if not self.is_map:
+            return [None]
+
+        over = self.options.over
+        items = list(_resolve_path(payload, over) if isinstance(over, str) else over(payload))
+
+        if not (size := self.options.chunk_size):
+            return [{"index": idx, "item": item} for idx, item in enumerate(items)]
+
+        return [
+            {"index": idx, "items": items[start : start + size]} for idx, start in enumerate(range(0, len(items), size))
+        ]
+
+
+def _plan_stages(steps: list[str | Step | Group | list[str | Step]]) -> list[PlanStep]:
+    """
+    Compile sequential stages into a plan where every step waits for the whole previous stage.
+    """
+    plan: list[PlanStep] = []
+    previous: tuple[int, ...] = ()
+
+    for step in steps:
+        substeps = [step] if isinstance(step, (str, Step)) else list(step.steps if isinstance(step, Group) else step)
+        start = len(plan)
+        group = (start, step.max_parallel) if isinstance(step, Group) and step.max_parallel else None
+        plan.extend(
+            PlanStep(_step_name(substep), previous, substep if isinstance(substep, Step) else None, group)
+            for substep in substeps
+        )
+        previous = tuple(range(start, len(plan)))
+
+    return plan
+
+
+def _plan_graph(graph: dict[str, list[str]], options: dict[str, Step] | None = None) -> list[PlanStep]:
+    """
+    Compile a dependency graph (step -> steps it depends on) into a plan in topological order.
+
+    Dependencies that are not declared as a key themselves are treated as steps without dependencies.
+    `options` holds the `Step` definition of steps that have options.
+
+    Raises:
+        ValueError: if the graph contains a cycle.
+    """
+    try:
+        order = list(graphlib.TopologicalSorter(graph).static_order())
+    except graphlib.CycleError as e:
+        raise ValueError(f"Pipeline dependencies contain a cycle: {' -> '.join(e.args[1])}") from e
+
+    options = options or {}
+    index = {name: idx for idx, name in enumerate(order)}
+    return [PlanStep(name, tuple(index[dep] for dep in graph.get(name, ())), options.get(name)) for name in order]
+
+
+def _plan_generations(plan: list[PlanStep]) -> list[str | list[str]]:
+    """
+    Group the nodes of a (topologically ordered) plan by their depth in the graph.
+
+    Single-step generations are returned as a plain string, like in a sequential pipeline definition.
+    """
+    depth: list[int] = []
+    for node in plan:
+        depth.append(1 + max((depth[dep] for dep in node.depends_on), default=-1))
+
+    generations: list[list[str]] = [[] for _ in range(max(depth, default=-1) + 1)]
+    for node, level in zip(plan, depth):
+        generations[level].append(node.entrypoint)
+
+    return [generation[0] if len(generation) == 1 else generation for generation in generations]
+
+
+def _plan_fingerprint(plan: list[PlanStep]) -> str:
+    """
+    Identify the structure of a plan, so a checkpoint is never resumed with a different pipeline definition.
+    """
+    structure = [[node.entrypoint, list(node.depends_on)] + (["map"] if node.is_map else []) for node in plan]
+    return hashlib.sha1(dumps_json(structure).encode()).hexdigest()
+
+
+@dc.dataclass
+class PlanState:
+    """
+    Progress of one run of a pipeline plan.
+
+    Attributes:
+        finished: Indices of the nodes that completed.
+        running: Index -> job ids of the nodes that are started but not completed yet
+            (a single job id for regular steps, one per element or chunk for map steps;
+            None for jobs that aren't enqueued yet).
+        attempts: Job id -> attempt number, for jobs that are retries of a failed job.
+        retries: (index, position) -> (attempt number, when it's due as a unix timestamp), for retries that
+            aren't enqueued yet (their job id in `running` is None), so a resumed run keeps their attempt and delay.
+    """
+
+    finished: set[int] = dc.field(default_factory=set)
+    running: dict[int, list[int | None]] = dc.field(default_factory=dict)
+    attempts: dict[int, int] = dc.field(default_factory=dict)
+    retries: dict[tuple[int, int], tuple[int, float]] = dc.field(default_factory=dict)
+
+    def ready(self, plan: list[PlanStep]) -> list[int]:
+        """
+        Indices of the nodes that can be enqueued: not started yet, with all dependencies finished.
+        """
+        return [
+            idx
+            for idx, node in enumerate(plan)
+            if idx not in self.finished and idx not in self.running and self.finished.issuperset(node.depends_on)
+        ]
+
+
+def _job_stub(
+    job_id: int,
+    entrypoint: str,
+    payload: bytes | None = None,
+    headers: dict[str, str] | None = None,
+    priority: int = 0,
+) -> Job:
+    """
+    Build a `Job` for work that didn't come from the queue (inline steps, adopted pipeline runs).
+    """
+    now = dt.datetime.now(dt.UTC)
+    return Job(
+        id=job_id,
+        priority=priority,
+        created=now,
+        updated=now,
+        heartbeat=now,
+        execute_after=now,
+        status="picked",
+        entrypoint=entrypoint,
+        payload=payload,
+        queue_manager_id=None,
+        headers=None if headers is None else dumps_json(headers),
+    )
+
+
+def _shielded(async_fn: AsyncTask) -> AsyncTask:
+    """
+    Let an (inline) entrypoint run to completion, even when whatever awaits it is cancelled.
+    """
+
+    @functools.wraps(async_fn)
+    async def wrapper(job: Job):
+        return await asyncio.shield(async_fn(job))
+
+    return wrapper
+
+
+@dc.dataclass(frozen=True)
+class PipelineDefinition:
+    """
+    A compiled pipeline with its options, attached to the callback returned by `ImprovedQueuer.pipeline()`
+    (as `callback.pipeline`).
+    """
+
+    plan: list[PlanStep]
+    meta: PipelineMeta
+    by_reference: bool = False
+    resumable: bool = False
+    max_parallel: int | None = None
+    detached: bool = False
+    completion_boost: int = 0
+
+
+def _flatten_plan(plan: list[PlanStep], nested: dict[str, PipelineDefinition]) -> list[PlanStep]:
+    """
+    Splice the plans of nested pipelines (entrypoint name -> definition) into a plan.
+
+    The nodes of a nested pipeline take the place of its node: its first nodes get that node's dependencies,
+    and a `collects` node (named after the nested pipeline, depending on its last nodes) takes over its dependents.
+    Nested pipelines whose step names clash with other steps of the plan keep running as a separate job,
+    since results are collected by step name, and so do nested pipelines used as a `Step` with options
+    or in a `Group` with `max_parallel`.
+    """
+    names = collections.Counter(node.entrypoint for node in plan)
+    flat: list[PlanStep] = []
+    new_index: dict[int, int] = {}
+
+    for idx, node in enumerate(plan):
+        deps = tuple(new_index[dep] for dep in node.depends_on)
+        group = (new_index[node.group[0]] if node.group[0] != idx else len(flat), node.group[1]) if node.group else None
+        # steps with options or in a limited group keep their own job, so the options/limit apply to the whole run:
+        definition = nested.get(node.entrypoint) if node.options is None and node.group is None else None
+
+        if definition is not None and not any(names[child.entrypoint] for child in definition.plan):
+            offset = len(flat)
+            meta = definition.meta | {"name": node.entrypoint}
+            for child in definition.plan:
+                names[child.entrypoint] += 1
+                flat.append(
+                    dc.replace(
+                        child,
+                        depends_on=tuple(offset + dep for dep in child.depends_on) or deps,
+                        group=(offset + child.group[0], child.group[1]) if child.group else group,
+                        context=child.context or meta,
+                    )
+                )
+
+            leaves = set(range(offset, len(flat))).difference(*(child.depends_on for child in flat[offset:]))
+            flat.append(PlanStep(node.entrypoint, tuple(sorted(leaves)) or deps, collects=meta))
+        else:
+            flat.append(dc.replace(node, depends_on=deps, group=group))
+
+        new_index[idx] = len(flat) - 1
+
+    return flat
+
+
+class Detached:
+    """
+    Returned by the job of a detached pipeline: the run continues in the background,
+    and its result is stored when it finishes.
+    """
 
 
 class ImprovedQueuer(PgQueuer):
@@ -165,8 +639,71 @@ class ImprovedQueuer(PgQueuer):
     - Job cancellation support
     - Crash protection for unreliable tasks
     - Pipeline execution with sequential and parallel steps
+
+    Attributes:
+        io: Driver for everything besides dequeueing and listening: storing and fetching results, logging,
+            enqueueing substeps and pipeline bookkeeping. The same as `connection`, unless a pool is used
+            (see `use_pool()`), so that I/O doesn't queue up behind the dequeue loop on a single connection.
+        queries: Queries (like enqueueing and cancelling) executed with `io`.
+        completions: Shared listener that resolves job-completion waits for all running pipelines.
+        result_listener: Shared listener that wakes up `result()` calls when their result is stored.
+        result_poll_interval: How often `result()` re-checks the table in case a notification got lost.
+        log_writer: Stores the entries of `log()` in batches, in the background (see `pgskewer.logs`).
+        log_rollup_interval: How often a running queuer calls `rollup_log()`.
+        log_rollup_batch_size: How many `pgqueuer_log` entries `rollup_log()` claims per query.
+        log_retention: How long rolled up `pgqueuer_log` entries are kept, None to keep them forever.
+        result_writer: Stores the results of jobs in batches (see `pgskewer.results`).
+            Set `result_writer.blob_threshold` to store large results compressed, outside of `pgqueuer_result`.
+        result_retention: How long results (and large result blobs) are kept, None to keep them forever.
+            Results are removed per day (partition), by `maintain_results()`.
+        result_maintenance_interval: How often a running queuer calls `maintain_results()`.
+        payload_codec: The codec (see `pgskewer.codecs`) used to encode the payloads of pipeline substeps.
+        memoized: Entrypoint name -> memoization policy, for entrypoints registered with `memoize`.
+        inline: Entrypoint name -> (function, crashable, store_results), for entrypoints registered with `inline`.
+        detached_pipelines: Entrypoint name -> definition, for pipelines registered with `detached=True`.
+        detached_runs: Unique key -> background task, for the detached pipeline runs this queuer is executing.
+        worker_id: Identifies this queuer as the owner of detached runs.
+        detached_heartbeat: How often this queuer confirms it is still executing its detached runs
+            (and looks for abandoned runs to adopt).
+        detached_stale_after: After how long without heartbeat a detached run is adopted by another queuer.
     """
 
+    io: Driver
+    queries: Queries
+    completions: CompletionHub
+    result_listener: ResultHub
+    result_poll_interval: dt.timedelta = dt.timedelta(seconds=5)
+    log_writer: LogWriter
+    log_rollup_interval: dt.timedelta = dt.timedelta(seconds=10)
+    log_rollup_batch_size: int = 10_000
+    log_retention: dt.timedelta | None = None
+    result_writer: ResultWriter
+    result_retention: dt.timedelta | None = None
+    result_maintenance_interval: dt.timedelta = dt.timedelta(hours=1)
+    payload_codec: str = "json"
+    memoized: dict[str, Memoize]
+    inline: dict[str, tuple[AsyncTask, bool, bool]]
+    detached_pipelines: dict[str, PipelineDefinition]
+    detached_runs: dict[str, asyncio.Task[None]]
+    worker_id: uuid.UUID
+    detached_heartbeat: dt.timedelta = dt.timedelta(seconds=15)
+    detached_stale_after: dt.timedelta = dt.timedelta(minutes=1)
+
+    def __post_init__(self) -> None:
+        super().__post_init__()
+        self.completions = CompletionHub(self.connection)
+        self.completions.shutdown = self.shutdown
+        self.result_listener = ResultHub(self.connection)
+        self.io = self.connection
+        self.queries = self.qm.queries
+        self.log_writer = LogWriter(self.io)
+        self.result_writer = ResultWriter(self.io)
+        self.memoized = {}
+        self.inline = {}
+        self.detached_pipelines = {}
+        self.detached_runs = {}
+        self.worker_id = uuid7()
+
     def entrypoint(
         self,
         name: str,
@@ -184,6 +721,8 @@ class ImprovedQueuer(PgQueuer):
         cancelable: bool = True,
         store_results: bool = True,
         crashable: bool = False,
+        memoize: bool | Memoize = False,
+        inline: bool = False,
     ) -> t.Callable[[AsyncTask], AsyncTask]:
         """
         Enhanced entrypoint decorator with additional job management features.
@@ -204,6 +743,12 @@ class ImprovedQueuer(PgQueuer):
             store_results: Whether to store job results in the database.
             crashable: Whether to prevent task failures from halting pipeline execution.
                 When True, exceptions are caught and None is returned instead of propagating.
+            memoize: Whether to cache the results of this (deterministic) entrypoint, keyed by its input.
+                Pass a `Memoize` to configure the ttl, the cache size or which part of the input is relevant.
+            inline: Whether pipelines run this (lightweight) entrypoint directly in their own event loop,
+                instead of enqueueing it for a worker. Its result is still stored in `pgqueuer_result`
+                (unless `store_results` is False), and with `cancelable=False` it finishes even when the
+                pipeline is cancelled.
 
         Returns:
             A decorator function that can be applied to async job functions.
@@ -220,10 +765,29 @@ class ImprovedQueuer(PgQueuer):
                     f"Please use only `async` functions (with `unblock`) for pgskewer entrypoints! (culprit: {func.__name__})"
                 )
 
+            if (definition := getattr(func, "pipeline", None)) and definition.detached:
+                self.detached_pipelines[name] = definition
+
+            raw_func = func
+
             if cancelable:
                 # Apply cancelable wrapper if requested
                 func = self.cancelable(func)
 
+            if memoize:
+                # Apply cache wrapper if requested (inside store_results, so cache hits are stored too)
+                policy = Memoize() if memoize is True else memoize
+                self.memoized[name] = policy
+                func = self.memoize(func, policy)
+
+            if inline:
+                # pipelines call this directly, and store the result themselves (see `_run_inline`)
+                inline_func = self.memoize(raw_func, policy) if memoize else raw_func
+                if not cancelable:
+                    # there's no job to cancel: shield it from the pipeline being cancelled instead
+                    inline_func = _shielded(inline_func)
+                self.inline[name] = (inline_func, crashable, store_results)
+
             if store_results:
                 # Apply results wrapper if requested
                 func = self.store_results(func)
@@ -274,17 +838,8 @@ class ImprovedQueuer(PgQueuer):
         async def wrapper(job: Job):
             exc = None
 
-            job_row = (
-                await self.connection.fetch(
-                    """
-                    SELECT dedupe_key
-                    FROM pgqueuer
-                    WHERE id = $1;
-                    """,
-                    job.id,
-                )
-            )[0]
-            # ^ before running the function, otherwise the row may already be removed
+            unique_key = await self.unique_key(job)
+            # ^ before running the function, otherwise the row may already be removed (if it isn't in the headers)
 
             try:
                 result = await async_fn(job)
@@ -294,19 +849,20 @@ class ImprovedQueuer(PgQueuer):
                     "exception": [type(exc).__name__, exc],
                 }
 
+            if isinstance(result, Detached):
+                # stored when the detached run finishes
+                return result
+
             # pgqueuer_log for job_id with status = 'successful' doesn't exit yet so store in pgqueuer_result table
+            # (batched with the results of other jobs that finish around the same time):
             ok = exc is None
-            await self.connection.execute(
-                """
-                INSERT INTO pgqueuer_result (job_id, entrypoint, result, ok, status, unique_key)
-                VALUES ($1, $2, $3, $4, $5, $6);
-                """,
+            await self.result_writer.write(
                 job.id,
                 job.entrypoint,
-                json.dumps(result, default=str),
+                result,
                 ok,
                 "successful" if ok else "exception",
-                job_row["dedupe_key"],
+                unique_key,
             )
 
             if exc is not None:
@@ -391,6 +947,262 @@ class ImprovedQueuer(PgQueuer):
 
         return wrapper
 
+    def memoize(self, async_fn: executors.EntrypointTypeVar, policy: Memoize) -> executors.EntrypointTypeVar:
+        """
+        Decorator that returns the cached result of a job with the same input, instead of running it again.
+
+        Only successful results are cached (in `pgskewer_memo_cache`). The input is the parsed payload
+        (with results passed by reference resolved, and large results loaded), narrowed down by `policy.key`.
+        Pipelines look memoized steps up in the cache themselves before enqueueing them,
+        so a cache hit doesn't even cost a job.
+
+        Example:
+            >>> @pgq.entrypoint("transcode", memoize=True)
+            ... async def transcode(job: Job): ...
+        """
+
+        @functools.wraps(async_fn)
+        async def wrapper(job: Job):
+            payload = parse_payload(job)
+            if isinstance(payload, dict) and payload.get("refs"):
+                payload = await self.resolve_tasks(t.cast(PipelinePayload, payload))
+
+            # hash what the step gets to see, not the pointers to large results (which differ between runs):
+            key = (job.entrypoint, policy.input_hash(await self._load_task_blobs(payload)))
+            cached = await self._memo_lookup([key])
+            if key in cached:
+                print(f"💾 {job.entrypoint} served from cache")
+                return cached[key]
+
+            result = await async_fn(job)
+            await self._memo_store(job.entrypoint, policy, {key[1]: result})
+            return result
+
+        return wrapper
+
+    async def _memo_lookup(self, keys: list[tuple[str, str]]) -> dict[tuple[str, str], t.Any]:
+        """
+        Find unexpired cached results for (entrypoint, input hash) pairs, with a single query.
+        """
+        if not keys:
+            return {}
+
+        rows = await self.io.fetch(
+            """
+            UPDATE pgskewer_memo_cache
+            SET last_used = NOW()
+            WHERE (entrypoint, input_hash) IN (SELECT * FROM unnest($1::text[], $2::text[]))
+              AND expires > NOW()
+            RETURNING entrypoint, input_hash, result;
+            """,
+            [entrypoint for entrypoint, _ in keys],
+            [input_hash for _, input_hash in keys],
+        )
+        return {(row["entrypoint"], row["input_hash"]): safe_json(row["result"]) for row in rows}
+
+    async def _memo_store(self, entrypoint: str, policy: Memoize, results: dict[str, t.Any]) -> None:
+        """
+        Cache results (input hash -> result) of a memoized entrypoint, and evict expired and excess entries.
+        """
+        await self.io.execute(
+            """
+            INSERT INTO pgskewer_memo_cache (entrypoint, input_hash, result, expires)
+            SELECT $1, input_hash, result::jsonb, NOW() + $4::interval
+            FROM unnest($2::text[], $3::text[]) AS cached (input_hash, result)
+            ON CONFLICT (entrypoint, input_hash) DO UPDATE
+                SET result    = EXCLUDED.result,
+                    created   = NOW(),
+                    last_used = NOW(),
+                    expires   = EXCLUDED.expires;
+            """,
+            entrypoint,
+            list(results),
+            [dumps_json(result, default=str) for result in results.values()],
+            policy.ttl,
+        )
+
+        if policy.max_entries is None:
+            await self.io.execute(
+                """
+                DELETE FROM pgskewer_memo_cache
+                WHERE entrypoint = $1 AND expires <= NOW();
+                """,
+                entrypoint,
+            )
+            return
+
+        await self.io.execute(
+            """
+            DELETE FROM pgskewer_memo_cache
+            WHERE entrypoint = $1
+              AND (
+                expires <= NOW()
+                OR input_hash IN (
+                    SELECT input_hash
+                    FROM pgskewer_memo_cache
+                    WHERE entrypoint = $1
+                    ORDER BY last_used DESC
+                    OFFSET $2
+                )
+              );
+            """,
+            entrypoint,
+            policy.max_entries,
+        )
+
+    async def _new_job_ids(self, amount: int) -> list[int]:
+        """
+        Reserve job ids (from the `pgqueuer` id sequence) for substeps that don't run as a queued job,
+        such as cache hits and inline steps.
+        """
+        rows = await self.io.fetch(
+            """
+            SELECT nextval(pg_get_serial_sequence('pgqueuer', 'id')) AS job_id
+            FROM generate_series(1, $1);
+            """,
+            amount,
+        )
+        return [row["job_id"] for row in rows]
+
+    async def _record_results(
+        self,
+        job_ids: list[int],
+        entrypoints: list[str],
+        task_results: list[TaskResult],
+        unique_keys: list[str],
+    ) -> None:
+        """
+        Store results of substeps that didn't run as a queued job in `pgqueuer_result`,
+        so they can be used like the result of any other job.
+        """
+        await asyncio.gather(
+            *(
+                self.result_writer.write(
+                    job_id, entrypoint, task_result["result"], task_result["ok"], task_result["status"], key
+                )
+                for job_id, entrypoint, task_result, key in zip(job_ids, entrypoints, task_results, unique_keys)
+            )
+        )
+
+    async def _run_inline(
+        self,
+        job_id: int,
+        entrypoint: str,
+        payload: bytes,
+        headers: dict[str, str],
+        timeout: float | None = None,
+    ) -> tuple[TaskResult | None, JOB_STATUS]:
+        """
+        Run an `inline` entrypoint in the current event loop, as if a worker picked it up as job `job_id`.
+
+        Returns:
+            The result to store (None if the entrypoint doesn't store its results), and the status the job
+            would have ended with (like in a worker, failures of a crashable entrypoint don't fail the job).
+        """
+        fn, crashable, store_results = self.inline[entrypoint]
+
+        try:
+            result = await asyncio.wait_for(fn(_job_stub(job_id, entrypoint, payload, headers)), timeout)
+        except Exception as e:  # noqa: BLE001 - like in a worker, anything the step raises fails the job
+            print(f"Warn: inline job `{entrypoint}` failed", file=sys.stderr)
+            traceback.print_exception(e)
+            failure: TaskResult = {"status": "exception", "ok": False, "result": {"exception": [type(e).__name__, e]}}
+            return (failure if store_results else None), "successful" if crashable else "exception"
+
+        return ({"status": "successful", "ok": True, "result": result} if store_results else None), "successful"
+
+    async def unique_key(self, job: Job) -> str | None:
+        """
+        Look up the unique key of a job (its `dedupe_key`), which identifies a run beyond the lifetime of its job id.
+
+        The key is read from the job headers, where pgskewer puts it when enqueueing.
+        For jobs enqueued without that header, it's queried, which only works while the job is still in the queue
+        (i.e. before it finishes).
+        """
+        if job.headers and (key := job.headers.get(UNIQUE_KEY_HEADER)):
+            return key
+
+        rows = await self.io.fetch(
+            """
+            SELECT dedupe_key
+            FROM pgqueuer
+            WHERE id = $1;
+            """,
+            job.id,
+        )
+        return rows[0]["dedupe_key"] if rows else None
+
+    async def cancel_run(self, unique_key: str) -> list[int]:
+        """
+        Cancel a (pipeline) run by its unique key, together with every job it spawned, recursively:
+        substeps, the substeps of nested pipelines, and so on.
+
+        Works for runs that are still in the queue and for detached runs. Cancelable entrypoints are interrupted
+        (which also kills the subprocess of an `unblock` call they're waiting for), jobs that aren't picked yet
+        won't run at all.
+
+        Returns:
+            The ids of the jobs that were cancelled.
+
+        Example:
+            >>> job = queue_job(db, "etl", {...})
+            >>> await pgq.cancel_run(str(job.key))
+        """
+        rows = await self.io.fetch(
+            """
+            SELECT id AS job_id
+            FROM pgqueuer
+            WHERE dedupe_key = $1
+            UNION
+            SELECT job_id
+            FROM pgskewer_pipeline_checkpoint
+            WHERE unique_key = $1;
+            """,
+            unique_key,
+        )
+        return await self.cancel_jobs([row["job_id"] for row in rows])
+
+    async def cancel_jobs(self, job_ids: list[int]) -> list[int]:
+        """
+        Cancel jobs and all of their descendants, found through the 'spawned' entries of pipeline jobs in `pgqueuer_log`.
+
+        The whole tree is collected with one (recursive) query and cancelled in bulk.
+        Jobs that already finished are skipped.
+
+        Returns:
+            The ids of the jobs that were cancelled.
+        """
+        if not job_ids:
+            return []
+
+        # the 'spawned' entries of this queuer's runs may still be buffered:
+        await self.log_writer.flush()
+
+        rows = await self.io.fetch(
+            """
+            WITH RECURSIVE tree (job_id) AS (
+                SELECT UNNEST($1::BIGINT[])
+                UNION
+                SELECT spawned.job_id::BIGINT
+                FROM tree
+                JOIN pgqueuer_log AS log
+                    ON log.job_id = tree.job_id
+                    AND log.status = 'spawned'
+                CROSS JOIN LATERAL JSONB_ARRAY_ELEMENTS_TEXT(log.traceback::JSONB) AS spawned (job_id)
+            )
+            SELECT pgqueuer.id
+            FROM pgqueuer
+            JOIN tree ON tree.job_id = pgqueuer.id
+            WHERE pgqueuer.status IN ('queued', 'picked');
+            """,
+            job_ids,
+        )
+        cancelled = [row["id"] for row in rows]
+        if cancelled:
+            await self.queries.mark_job_as_cancelled(cancelled)
+
+        return cancelled
+
     async def log(
         self,
         job: Job,
@@ -398,26 +1210,22 @@ class ImprovedQueuer(PgQueuer):
         data: str | t.Any,
         priority: int = 0,
     ):
-        await self.connection.execute(
-            """
-            INSERT INTO pgqueuer_log (job_id, status, priority, entrypoint, traceback)
-            VALUES ($1,
-                    $2,
-                    $3,
-                    $4,
-                    $5)
-            """,
-            job.id,
-            status,
-            priority,
-            job.entrypoint,
-            data if isinstance(data, str) else json.dumps(data),
-        )
+        """
+        Add an entry to `pgqueuer_log` for a job. Entries are stored in batches (see `log_writer`),
+        so this only waits when the database falls behind.
+        """
+        await self.log_writer.write(job.id, status, priority, job.entrypoint, data)
 
     def pipeline(
         self,
         *input_steps: InputStep,
         check: bool = True,
+        by_reference: bool = False,
+        resumable: bool = False,
+        max_parallel: int | None = None,
+        detached: bool = False,
+        flatten: bool = True,
+        completion_boost: int = 0,
     ) -> AsyncTask:
         """
         Defines a pipeline of tasks to be executed in sequence or parallel.
@@ -439,17 +1247,120 @@ class ImprovedQueuer(PgQueuer):
         You can pass steps using either:
         - A single list of steps (as shown above), or
         - Variadic arguments (e.g. `pgq.pipeline(task_1, ["task_2a", task_2b], "task_3")`)
+        - A single dict mapping each step to the step(s) it depends on (see below)
 
         Each step can be either:
         - The **name** of an entrypoint (as a `str`)
         - A **reference** to an `AsyncTask` function
 
+        ### Dependency-driven pipelines
+
+        Sequential stages act as barriers: `task_3` above only starts after *both* `task_2a` and `task_2b`
+        are done, even if it only needs one of them. By passing a dict instead, every step declares what it
+        depends on and is enqueued as soon as those dependencies have finished:
+            pgq.pipeline({
+                "extract": [],
+                "transform_slow": ["extract"],
+                "transform_fast": ["extract"],
+                "load_fast": ["transform_fast"],  # doesn't wait for transform_slow
+            })
+        A single dependency may be passed without a list. Cyclic dependencies raise a `ValueError`.
+        When a step fails, all running steps are terminated and the pipeline halts.
+
+        ### Map steps
+
+        Wrap a step in `Step(..., over=...)` to run it once for every element of a list, taken from the
+        pipeline payload (with a dotted path like "initial.urls" or "tasks.extract.result", or a function
+        that receives the payload). All jobs of a map step are enqueued with a single bulk insert,
+        and each one finds its element in `payload["map"]["item"]`. With `chunk_size=n`, every job gets
+        up to `n` elements in `payload["map"]["items"]` instead:
+            pgq.pipeline(
+                "extract",
+                Step("transform", over="tasks.extract.result", chunk_size=100),
+                "reduce",
+            )
+        The result of a map step is the list of results of its jobs, in input order,
+        so the next step can reduce them. If one of the jobs fails, the others are cancelled.
+
+        ### Limiting concurrency
+
+        By default, all steps (and all jobs of a map step) that can run are enqueued at once.
+        To keep one wide pipeline run from flooding the queue, limit the number of jobs it has
+        in flight at the same time; further jobs are enqueued as earlier ones complete:
+        - for the whole run: `pgq.pipeline(..., max_parallel=10)`
+        - for a parallel group: `Group(["resize", "ocr", "thumbnail"], max_parallel=2)` instead of a list
+        - for a map step: `Step("transform", over="initial.urls", max_parallel=50)`
+
         If `check=True` (default), any task provided by **name** (as a string) will be validated
         against the task registry. If a name is missing, a warning will be shown.
         This helps catch typos or missing entrypoints.
         If you're defining the pipeline **before** the entrypoints are registered,
         you can set `check=False` to skip this validation.
 
+        ### Priority
+
+        Substeps are enqueued with the priority of the pipeline job, so a high-priority run doesn't wait
+        behind bulk work. With `completion_boost=n`, substeps get up to `n` extra priority in proportion to
+        the share of steps that already finished, so runs in flight finish before new runs get going.
+
+        ### Timeouts and retries
+
+        A substep that hangs would stall its pipeline, and a transient failure fails the whole run.
+        `Step` takes a per-job `timeout` (after which the job is cancelled and counts as failed) and
+        a retry policy: `retries` (extra attempts), `backoff` (base delay, doubled every attempt, with jitter)
+        and `retry_on` (exception classes or class names to retry; all failures by default):
+            pgq.pipeline(Step("fetch", timeout=30, retries=3, backoff=2, retry_on=[TimeoutError, "HTTPError"]), "store")
+        A timed-out job counts as a `TimeoutError`. Only when a job runs out of attempts does the pipeline fail.
+
+        ### Inline steps
+
+        Entrypoints registered with `inline=True` are not enqueued, but run directly in the event loop of the
+        pipeline job (their results are still stored in `pgqueuer_result`). Use it for lightweight glue steps,
+        where the queue round trip costs more than the work itself.
+
+        ### Passing results by reference
+
+        By default, every substep receives the results of all steps before it in its payload.
+        For long pipelines with large intermediate results, set `by_reference=True`: substeps then receive
+        an empty `tasks` dict and a `refs` dict (step name -> job id) instead, and load only the results
+        they actually need from `pgqueuer_result`:
+            @pgq.entrypoint("load")
+            async def load(job: Job):
+                payload = parse_payload(job.payload)
+                transformed = await pgq.task_result(payload, "transform")
+
+        ### Resuming after a crash
+
+        With `resumable=True`, the progress of a run is checkpointed (in `pgskewer_pipeline_checkpoint`, keyed by
+        the unique key of the pipeline job) every time substeps are enqueued or complete.
+        When the pipeline job is started again after its worker died (e.g. by pgqueuer, when the entrypoint
+        has a `retry_timer`), completed steps are skipped and their stored results reused, and steps that were
+        still running are waited for instead of enqueued again. Checkpoints are removed when the run finishes
+        or fails, and ignored if the pipeline definition changed in the meantime.
+
+        ### Nested pipelines
+
+        A step can be another (registered) pipeline. Its steps are spliced into this pipeline's plan when it is
+        defined, so the whole run is driven by a single orchestrator job, without a queue round trip (and a worker
+        slot) per nesting level. Its steps still see the nested pipeline in `payload["pipeline"]`, and its result
+        is still stored under its name in `tasks`, once all of its steps are done.
+        Nested pipelines that are detached, have a `max_parallel`, are used as a `Step` with options or in a limited
+        `Group`, or share step names with the outer pipeline run as a separate job instead, as does every nested
+        pipeline when `flatten=False`. So do nested pipelines whose `by_reference`, `resumable` or `completion_boost`
+        differ from the outer pipeline's, since flattened steps are run with the options of the outer pipeline.
+
+        ### Detached runs
+
+        Normally, the pipeline job waits for all of its steps, occupying a worker slot for the whole run
+        (and nested pipelines occupy one slot per level). With `detached=True`, the job only registers the run
+        (in `pgskewer_pipeline_checkpoint`) and finishes right away; the run continues as a background task of
+        the worker, advanced by completion notifications. Thousands of runs can wait on a handful of workers.
+        The worker keeps a heartbeat on its runs; runs of a worker that died (or shut down) are adopted by another
+        worker that has the pipeline registered, and resumed from their checkpoint.
+        The result of the run is stored under the id of the pipeline job once it finishes, so wait for the
+        *result* (e.g. with `pgq.result(job_id)`) instead of the job status. Pipelines that use a detached pipeline
+        as a step take care of that themselves.
+
         ### Result structure
 
         The pipeline returns a `PipelinePayload` with the following structure:
@@ -469,8 +1380,6 @@ class ImprovedQueuer(PgQueuer):
         """
 
         # todo:
-        #  - configuring timeouts (which pgqueuer doesn't seem to support?)
-        #  - configuring retries (which pgqueuer should already support?)
         #  - improved pytests/coverage
 
         key_to_fn = t.cast(
@@ -480,9 +1389,13 @@ class ImprovedQueuer(PgQueuer):
         fn_to_key = {v: k for k, v in key_to_fn.items()}
 
         # 1. Map functions into entrypoint names
-        def map_step(step: str | AsyncTask):
+        def map_step(step: str | AsyncTask | Step):
             if isinstance(step, str):
                 return step
+            elif isinstance(step, Step):
+                return dc.replace(step, entrypoint=map_step(step.entrypoint))
+            elif isinstance(step, Group):
+                return dc.replace(step, steps=[map_step(s) for s in step.steps])
             elif callable(step):
                 if step in fn_to_key:
                     return fn_to_key[step]
@@ -493,82 +1406,861 @@ class ImprovedQueuer(PgQueuer):
             else:
                 raise TypeError(f"Step must be a string, function, or Sequence, not {type(step)}")
 
-        # 2. Ensure pipeline() can be called with one list as input or multiple inputs
-        if len(input_steps) == 1 and isinstance(input_steps[0], list):
-            # Single list input
-            steps = [map_step(step) for step in input_steps[0]]
+        # 2. Ensure pipeline() can be called with one list (or dependency dict) as input or multiple inputs
+        meta: PipelineMeta
+        if len(input_steps) == 1 and isinstance(input_steps[0], t.Mapping):
+            # Dependency graph input
+            graph: dict[str, list[str]] = {}
+            options: dict[str, Step] = {}
+            for step, dependencies in input_steps[0].items():
+                dependencies = (
+                    [dependencies] if isinstance(dependencies, (str, Step)) or callable(dependencies) else dependencies
+                )
+                step = map_step(step)
+                if isinstance(step, Step):
+                    options[step.entrypoint] = step
+                graph[_step_name(step)] = [_step_name(map_step(dependency)) for dependency in dependencies]
+
+            plan = _plan_graph(graph, options)
+            meta = {
+                "name": "",
+                "steps": _plan_generations(plan),
+                "depends_on": {node.entrypoint: [plan[dep].entrypoint for dep in node.depends_on] for node in plan},
+            }
         else:
-            # Multiple inputs
-            steps = [map_step(step) for step in input_steps]
+            if len(input_steps) == 1 and isinstance(input_steps[0], list):
+                # Single list input
+                steps = [map_step(step) for step in input_steps[0]]
+            else:
+                # Multiple inputs
+                steps = [map_step(step) for step in input_steps]
+
+            plan = _plan_stages(steps)
+            meta = {
+                "name": "",
+                "steps": [
+                    _step_name(step)
+                    if isinstance(step, (str, Step))
+                    else [_step_name(s) for s in (step.steps if isinstance(step, Group) else step)]
+                    for step in steps
+                ],
+            }
+
+        if max_parallel is not None and max_parallel < 1:
+            raise ValueError("max_parallel must be at least 1")
+
+        if flatten:
+            # run the steps of nested pipelines from this orchestrator, instead of enqueueing another one
+            # (if that orchestrator runs them the way the nested pipeline would):
+            nested = {
+                name: nested_definition
+                for name, fn in key_to_fn.items()
+                if (nested_definition := getattr(fn, "pipeline", None))
+                and not nested_definition.detached
+                and nested_definition.max_parallel is None
+                and nested_definition.by_reference == by_reference
+                and nested_definition.resumable == resumable
+                and nested_definition.completion_boost == completion_boost
+            }
+            plan = _flatten_plan(plan, nested)
 
         # 3. Check for missing steps if check is True
         if check:
-            for step in steps:
-                if isinstance(step, str) and step not in key_to_fn:
-                    print(f"warn: step '{step}' is missing, are you declaring a pipeline before the steps it uses?")
-                elif isinstance(step, list):
-                    for substep in step:
-                        if isinstance(substep, str) and substep not in key_to_fn:
-                            print(
-                                f"warn: step '{substep}' is missing, are you declaring a pipeline before the steps it uses?"
-                            )
+            for node in plan:
+                if node.entrypoint not in key_to_fn:
+                    print(
+                        f"warn: step '{node.entrypoint}' is missing, are you declaring a pipeline before the steps it uses?"
+                    )
+
+        definition = PipelineDefinition(plan, meta, by_reference, resumable, max_parallel, detached, completion_boost)
 
-        async def callback(job: Job) -> PipelinePayload:
-            raw_payload = safe_json(job.payload)
+        async def callback(job: Job) -> PipelinePayload | Detached:
+            raw_payload = parse_payload(job)
 
-            initial, tasks = _extract_initial_payload(raw_payload)
+            initial, tasks, refs = _extract_initial_payload(raw_payload)
 
             results: PipelinePayload = {
                 "initial": initial,
-                "pipeline": {
-                    "name": job.entrypoint,
-                    "steps": steps,
-                },
+                "pipeline": meta | {"name": job.entrypoint},
                 "tasks": tasks,
             }
 
-            driver = self.connection
+            if refs or by_reference:
+                # the final result should contain every task, including the ones a parent pipeline passed by reference:
+                results["refs"] = refs
+                await self.resolve_tasks(results)
 
-            for step in steps:
-                substeps = [step] if isinstance(step, str) else list(step)
+                if not by_reference:
+                    del results["refs"]
 
-                payload = json.dumps(results).encode()
+            if detached:
+                await self._detach(job, definition, results)
+                return Detached()
 
-                queue = self.qm.queries
-                job_ids = await queue.enqueue(
-                    substeps,
-                    payload=[payload] * len(substeps),
-                    priority=[0] * len(substeps),
-                    dedupe_key=[str(uuid7()) for _ in substeps],
+            checkpoint = await self.unique_key(job) if resumable else None
+            if resumable and not checkpoint:
+                print(
+                    f"Warn: `{job.entrypoint}` job {job.id} has no unique key, so its progress isn't saved",
+                    file=sys.stderr,
                 )
+            await self._run_plan(
+                job,
+                plan,
+                results,
+                checkpoint=checkpoint,
+                max_parallel=max_parallel,
+                completion_boost=completion_boost,
+            )
+            return results
+
+        callback.pipeline = definition  # type: ignore[attr-defined]
+        return callback
 
-                await self.log(job, "spawned", job_ids)
+    async def _run_plan(
+        self,
+        job: Job,
+        plan: list[PlanStep],
+        results: PipelinePayload,
+        checkpoint: str | None = None,
+        max_parallel: int | None = None,
+        completion_boost: int = 0,
+        drop_checkpoint: bool = True,
+    ) -> None:
+        """
+        Execute a compiled pipeline plan on behalf of the pipeline job `job`.
 
-                async with CompletionWatcher(driver) as w:
-                    jobs = [w.wait_for(j) for j in job_ids]
-                    named_jobs = [named_future(name, job_id, fut) for name, job_id, fut in zip(substeps, job_ids, jobs)]
+        Every node is started as soon as all of its dependencies have finished. Map steps are expanded
+        into one job per element (or chunk) at that point. Jobs that can be enqueued at the same time are
+        enqueued together (as one 'spawned' batch), as far as the concurrency windows allow:
+        at most `max_parallel` jobs of the whole run, of a `Group` and of a map step are in flight at once.
+        Results of finished nodes are collected into `results["tasks"]`, which is also passed
+        (as payload) to every node enqueued afterward - or only referenced, if `results` has `refs`.
+        Jobs are enqueued with the priority of the pipeline job, raised by up to `completion_boost`
+        as the share of finished nodes grows.
 
-                    for coro in asyncio.as_completed(named_jobs):
-                        substep, job_id, status = await coro
+        If a `checkpoint` key is passed, progress is saved under that key and a previous
+        (interrupted) run with the same key is resumed. The checkpoint is dropped when the run ends,
+        unless `drop_checkpoint` is False (e.g. when the caller still has to store the result of the run).
 
-                        if status == "exception" or isinstance(status, Exception):
-                            await queue.mark_job_as_cancelled(job_ids)
-                            raise SubstepFailed(substep)
+        Raises:
+            SubstepFailed: when a node fails (or is cancelled). All other running nodes, and whatever they spawned,
+                are cancelled first, like they are when planning the next nodes fails
+                (e.g. because a map step's `over` path doesn't exist).
+        """
+        queue = self.queries
+        state = PlanState()
+        waiting: dict[asyncio.Task[tuple[str, int, JOB_STATUS | Exception]], int] = {}
+        # job ids of running nodes that didn't complete yet (map steps complete when all of their jobs have):
+        pending: dict[int, set[int]] = {}
+        # jobs of running nodes that are waiting to be enqueued (for room in a concurrency window, or to be retried),
+        # as (position, attempt):
+        backlog: dict[int, collections.deque[tuple[int, int]]] = {}
+        units: dict[int, list[MapItem | None]] = {}
+        # retries waiting for their backoff delay, as (index, position, attempt):
+        delayed: dict[asyncio.Task[None], tuple[int, int, int]] = {}
+
+        await self.completions.start()
+
+        def start(idx: int, node_units: list[MapItem | None], job_ids: t.Sequence[int | None] = ()) -> None:
+            units[idx] = node_units
+            state.running[idx] = [None] * len(node_units)
+            pending[idx] = set()
+            backlog[idx] = collections.deque()
+            for position in range(len(node_units)):
+                if position < len(job_ids) and (job_id := job_ids[position]) is not None:
+                    watch(idx, position, job_id)
+                elif (idx, position) in state.retries:
+                    # a retry that wasn't enqueued before the run was interrupted: wait out the rest of its delay
+                    attempt, due = state.retries[idx, position]
+                    delayed[asyncio.ensure_future(asyncio.sleep(max(due - time.time(), 0)))] = (idx, position, attempt)
+                else:
+                    backlog[idx].append((position, 1))
+
+        def watch(idx: int, position: int, job_id: int, status: JOB_STATUS | None = None) -> None:
+            state.running[idx][position] = job_id
+            state.retries.pop((idx, position), None)
+            pending[idx].add(job_id)
+
+            completion: t.Awaitable[JOB_STATUS] = self.completions.wait_for(job_id)
+            if status is not None:
+                # already done without running as a job (e.g. a cache hit)
+                completion = asyncio.get_running_loop().create_future()
+                completion.set_result(status)
+            elif plan[idx].entrypoint in self.detached_pipelines:
+                # the job of a detached pipeline finishes right away, the run itself is done when its result is stored
+                completion = self._result_status(job_id)
+
+            if status is None and (options := plan[idx].options) and options.timeout is not None:
+                completion = asyncio.wait_for(completion, options.timeout)
+
+            task = asyncio.ensure_future(named_future(plan[idx].entrypoint, job_id, completion))
+            waiting[task] = idx
+
+        async def start_ready() -> None:
+            while ready := state.ready(plan):
+                for idx in ready:
+                    node = plan[idx]
+                    if node.collects is not None:
+                        # all nodes of a flattened nested pipeline are done: collect them into its result
+                        results["tasks"][node.entrypoint] = _nested_result(plan, idx, results)
+                        state.finished.add(idx)
+                        continue
+
+                    if node_units := await self._plan_units(node, results):
+                        start(idx, node_units)
+                        continue
+
+                    # mapping over an empty list: nothing to do, but this might unblock other nodes
+                    results["tasks"][node.entrypoint] = _map_result([])
+                    if "refs" in results:
+                        results["refs"][node.entrypoint] = []
+                    state.finished.add(idx)
+
+        def take_units() -> list[tuple[int, int, int]]:
+            # fill the concurrency windows, in plan order:
+            budget = max_parallel - len(waiting) if max_parallel else sum(map(len, backlog.values()))
+            group_budget: dict[int, int] = {}
+            taken: list[tuple[int, int, int]] = []
+
+            for idx, queued in backlog.items():
+                node = plan[idx]
+                amount = min(len(queued), budget)
+                if node.options and node.options.max_parallel:
+                    amount = min(amount, node.options.max_parallel - len(pending[idx]))
+                if node.group:
+                    group, limit = node.group
+                    if group not in group_budget:
+                        in_flight = sum(len(pending[other]) for other in pending if plan[other].group == node.group)
+                        group_budget[group] = limit - in_flight
+                    amount = min(amount, group_budget[group])
+                    group_budget[group] -= max(amount, 0)
+
+                for _ in range(amount):
+                    taken.append((idx, *queued.popleft()))
+                budget -= max(amount, 0)
+
+            return taken
+
+        async def spawn_ready() -> bool:
+            await start_ready()
+            if not (taken := take_units()):
+                return False
+
+            # memoized steps that are in the cache don't have to be enqueued at all:
+            memo_keys: dict[int, tuple[str, str]] = {}
+            for i, (idx, position, _) in enumerate(taken):
+                if policy := self.memoized.get(plan[idx].entrypoint):
+                    unit = units[idx][position]
+                    memo_input = results if unit is None else results | {"map": unit}
+                    memo_input = await self._load_task_blobs(memo_input)
+                    memo_keys[i] = (plan[idx].entrypoint, policy.input_hash(memo_input))
+
+            if cached := await self._memo_lookup(list(memo_keys.values())):
+                hits = [i for i, key in memo_keys.items() if key in cached]
+                hit_ids = await self._new_job_ids(len(hits))
+                await self._record_results(
+                    hit_ids,
+                    [plan[taken[i][0]].entrypoint for i in hits],
+                    [{"status": "successful", "ok": True, "result": cached[memo_keys[i]]} for i in hits],
+                    # like a queued substep, a cache hit gets a unique key of its own:
+                    [str(uuid7()) for _ in hits],
+                )
+                await self.log(job, "spawned", hit_ids)
+                for i, job_id in zip(hits, hit_ids):
+                    print(f"💾 {plan[taken[i][0]].entrypoint} served from cache")
+                    watch(taken[i][0], taken[i][1], job_id, "successful")
+
+                taken = [unit for i, unit in enumerate(taken) if i not in hits]
+                if not taken:
+                    return True
+
+            payload = _substep_payload(results)
+            entrypoints: list[str] = []
+            payloads: list[bytes] = []
+            headers: list[dict[str, str]] = []
+
+            for idx, position, _ in taken:
+                node = plan[idx]
+                unit = units[idx][position]
+                node_payload = payload if node.context is None else payload | {"pipeline": node.context}
+                encoded, unit_headers = encode_payload(
+                    node_payload if unit is None else node_payload | {"map": unit},
+                    self.payload_codec,
+                )
+                entrypoints.append(node.entrypoint)
+                payloads.append(encoded)
+                headers.append(unit_headers)
+
+            queued = [i for i, entrypoint in enumerate(entrypoints) if entrypoint not in self.inline]
+            inlined = [i for i, entrypoint in enumerate(entrypoints) if entrypoint in self.inline]
+            job_ids = [0] * len(taken)
+            keys = [str(uuid7()) for _ in taken]
+            headers = [unit_headers | {UNIQUE_KEY_HEADER: key} for unit_headers, key in zip(headers, keys)]
+
+            if queued:
+                # substeps inherit the priority of the run, runs that are further along get ahead of newer ones:
+                priority = job.priority + completion_boost * len(state.finished) // len(plan)
+                queued_ids = await queue.enqueue(
+                    [entrypoints[i] for i in queued],
+                    payload=[payloads[i] for i in queued],
+                    priority=[priority] * len(queued),
+                    dedupe_key=[keys[i] for i in queued],
+                    headers=[headers[i] for i in queued],
+                )
+                for i, job_id in zip(queued, queued_ids):
+                    job_ids[i] = job_id
+
+            if inlined:
+                for i, job_id in zip(inlined, await self._new_job_ids(len(inlined))):
+                    job_ids[i] = job_id
+
+            await self.log(job, "spawned", job_ids)
+
+            statuses: dict[int, JOB_STATUS] = {}
+            if inlined:
+                # lightweight steps run right here (concurrently), instead of making a round trip through the queue:
+                outcomes = await asyncio.gather(
+                    *(
+                        self._run_inline(
+                            job_ids[i],
+                            entrypoints[i],
+                            payloads[i],
+                            headers[i],
+                            timeout=options.timeout if (options := plan[taken[i][0]].options) else None,
+                        )
+                        for i in inlined
+                    )
+                )
+                stored = [(i, task_result) for i, (task_result, _) in zip(inlined, outcomes) if task_result is not None]
+                await self._record_results(
+                    [job_ids[i] for i, _ in stored],
+                    [entrypoints[i] for i, _ in stored],
+                    [task_result for _, task_result in stored],
+                    [keys[i] for i, _ in stored],
+                )
+                statuses = {i: status for i, (_, status) in zip(inlined, outcomes)}
+
+            for i, ((idx, position, attempt), job_id) in enumerate(zip(taken, job_ids)):
+                if attempt > 1:
+                    state.attempts[job_id] = attempt
+                watch(idx, position, job_id, statuses.get(i))
+
+            return True
+
+        async def retry(idx: int, job_id: int, status: JOB_STATUS | Exception) -> bool:
+            # enqueue a failed job again (later), if its step allows it:
+            options = plan[idx].options
+            attempt = state.attempts.pop(job_id, 1)
+            if not options or not options.retries or status == "canceled":
+                return False
+
+            exception = None
+            if isinstance(status, Exception):
+                exception = type(status).__name__
+            elif options.retry_on:
+                exception = _exception_name(await self.result(job_id, timeout=1))
+
+            if not options.should_retry(attempt, exception):
+                return False
+
+            # wait here instead of using `execute_after`, since workers only notice delayed jobs when they poll:
+            delay = options.retry_delay(attempt + 1)
+            print(f"🔁 retrying {plan[idx].entrypoint} in {delay} (attempt {attempt + 1} of {options.retries + 1})")
+            position = state.running[idx].index(job_id)
+            state.running[idx][position] = None
+            state.retries[idx, position] = (attempt + 1, time.time() + delay.total_seconds())
+            delayed[asyncio.ensure_future(asyncio.sleep(delay.total_seconds()))] = (idx, position, attempt + 1)
+            return True
 
+        try:
+            if checkpoint and (saved := await self._load_checkpoint(checkpoint, plan)):
+                if saved["finished"] or saved["running"]:
+                    print(f"↪️ resuming {job.entrypoint} from checkpoint {checkpoint}")
+                results["tasks"] = saved["tasks"]
+                if "refs" in results:
+                    results["refs"] = saved.get("refs", {})
+
+                state.finished = set(saved["finished"])
+                state.attempts = dict(saved.get("attempts", []))
+                state.retries = {
+                    (idx, position): (attempt, due) for idx, position, attempt, due in saved.get("retries", [])
+                }
+                for idx, job_ids in saved["running"]:
+                    # jobs that were already enqueued are waited for, the rest (if any) is enqueued later:
+                    start(idx, await self._plan_units(plan[idx], results), job_ids)
+
+            await spawn_ready()
+            if checkpoint:
+                await self._save_checkpoint(checkpoint, job, plan, state, results)
+
+            while waiting or delayed:
+                done, _ = await asyncio.wait([*waiting, *delayed], return_when=asyncio.FIRST_COMPLETED)
+
+                completed: list[int] = []
+                retried = False
+                for task in done:
+                    if task in delayed:
+                        # backoff is over, enqueue the retry (with priority over the rest of the backlog):
+                        idx, position, attempt = delayed.pop(task)
+                        backlog[idx].appendleft((position, attempt))
+                        continue
+
+                    idx = waiting.pop(task)
+                    substep, job_id, status = task.result()
+                    pending[idx].discard(job_id)
+
+                    if isinstance(status, TimeoutError):
+                        print(f"⏱️ {substep} timed out")
+                        await self.cancel_jobs([job_id])
+
+                    if status in ("exception", "canceled") or isinstance(status, Exception):
+                        if await retry(idx, job_id, status):
+                            retried = True
+                            continue
+
+                        raise SubstepFailed(substep)
+
+                    if not pending[idx] and not backlog[idx] and None not in state.running[idx]:
+                        del pending[idx], backlog[idx], units[idx]
                         print(f"✅ {substep} completed: {status}")
+                        completed.append(idx)
+
+                if completed:
+                    # fetch the results of everything that completed at the same time in one go:
+                    job_ids = [job_id for idx in completed for job_id in state.running[idx]]
+                    # large results stay in their blob: later steps get a pointer, not a copy
+                    task_results = self.results_many(job_ids, timeout=1, load_blobs=False)
+                    async with contextlib.aclosing(task_results) as task_results:
+                        fetched = {job_id: task_result async for job_id, task_result in task_results}
+
+                    for idx in completed:
+                        node = plan[idx]
+                        node_job_ids = t.cast(list[int], state.running.pop(idx))
+                        ref: int | list[int] | None = None
+                        if node.is_map:
+                            results["tasks"][node.entrypoint] = _map_result([fetched.get(j) for j in node_job_ids])
+                            ref = node_job_ids
+                        elif node_job_ids[0] in fetched:
+                            results["tasks"][node.entrypoint] = fetched[node_job_ids[0]]
+                            ref = node_job_ids[0]
+
+                        if "refs" in results and ref is not None:
+                            results["refs"][node.entrypoint] = ref
+
+                        state.finished.add(idx)
+
+                # start newly unblocked nodes, retries, and top up the concurrency windows:
+                spawned = await spawn_ready()
+                if checkpoint and (completed or spawned or retried):
+                    await self._save_checkpoint(checkpoint, job, plan, state, results)
+
+            if checkpoint and drop_checkpoint:
+                await self._drop_checkpoint(checkpoint)
+        except Exception:
+            # a failed node, or planning the next ones failed: stop everything this run enqueued,
+            # including whatever those spawned themselves (e.g. the substeps of a nested pipeline)
+            await self.cancel_jobs([other for ids in pending.values() for other in ids])
+            if checkpoint and drop_checkpoint:
+                await self._drop_checkpoint(checkpoint)
+            raise
+        finally:
+            # stop waiting for whatever is still running (after a failure or when this job is cancelled):
+            for task in [*waiting, *delayed]:
+                task.cancel()
+
+    async def _load_checkpoint(self, key: str, plan: list[PlanStep]) -> dict[str, t.Any] | None:
+        """
+        Load the saved progress of an interrupted pipeline run, if it was made with the same plan.
+        """
+        rows = await self.io.fetch(
+            """
+            SELECT state
+            FROM pgskewer_pipeline_checkpoint
+            WHERE unique_key = $1;
+            """,
+            key,
+        )
+        if not rows:
+            return None
 
-                        if task_result := await self.result(job_id, timeout=1):
-                            results["tasks"][substep] = task_result
+        saved = safe_json(rows[0]["state"])
+        if not saved or saved.get("plan") != _plan_fingerprint(plan):
+            print(f"warn: ignoring checkpoint {key}, the pipeline definition changed", file=sys.stderr)
+            return None
 
-            return results
+        return saved
 
-        return callback
+    async def _save_checkpoint(
+        self,
+        key: str,
+        job: Job,
+        plan: list[PlanStep],
+        state: PlanState,
+        results: PipelinePayload,
+    ) -> None:
+        """
+        Save the progress of a pipeline run, so it can be resumed when it is interrupted.
+        """
+        saved = {
+            "plan": _plan_fingerprint(plan),
+            "finished": sorted(state.finished),
+            "running": list(state.running.items()),
+            "attempts": list(state.attempts.items()),
+            "retries": [[idx, position, attempt, due] for (idx, position), (attempt, due) in state.retries.items()],
+            "initial": results["initial"],
+            "tasks": results["tasks"],
+            "priority": job.priority,
+        }
+        if "refs" in results:
+            saved["refs"] = results["refs"]
+
+        await self.io.execute(
+            """
+            INSERT INTO pgskewer_pipeline_checkpoint (unique_key, job_id, entrypoint, state)
+            VALUES ($1, $2, $3, $4)
+            ON CONFLICT (unique_key) DO UPDATE
+                SET job_id  = EXCLUDED.job_id,
+                    state   = EXCLUDED.state,
+                    updated = NOW();
+            """,
+            key,
+            job.id,
+            job.entrypoint,
+            dumps_json(saved, default=str),
+        )
+
+    async def _drop_checkpoint(self, key: str) -> None:
+        await self.io.execute(
+            """
+            DELETE FROM pgskewer_pipeline_checkpoint
+            WHERE unique_key = $1;
+            """,
+            key,
+        )
+
+    async def _result_status(self, job_id: int) -> JOB_STATUS:
+        """
+        Wait for the result of a job and return its status.
+        """
+        result = await self.result(job_id)
+        return result["status"] if result else "exception"
+
+    async def _detach(self, job: Job, definition: PipelineDefinition, results: PipelinePayload) -> None:
+        """
+        Persist a new run of a detached pipeline and continue it in the background, so its job can finish right away.
+
+        Raises:
+            ValueError: if the job has no unique key, which identifies the run and its result.
+        """
+        key = await self.unique_key(job)
+        if not key:
+            raise ValueError(f"detached pipeline job {job.id} ({job.entrypoint}) has no unique key (dedupe_key)")
+
+        # register the run first, so it can be adopted if this worker dies before the run is done.
+        # if the job was retried, the existing checkpoint (and its progress) is kept:
+        await self.io.execute(
+            """
+            INSERT INTO pgskewer_pipeline_checkpoint (unique_key, job_id, entrypoint, state, detached, owner)
+            VALUES ($1, $2, $3, $4, TRUE, $5)
+            ON CONFLICT (unique_key) DO UPDATE
+                SET detached = TRUE,
+                    owner    = EXCLUDED.owner,
+                    updated  = NOW();
+            """,
+            key,
+            job.id,
+            job.entrypoint,
+            dumps_json(
+                {
+                    "plan": _plan_fingerprint(definition.plan),
+                    "finished": [],
+                    "running": [],
+                    "initial": results["initial"],
+                    "tasks": results["tasks"],
+                    "priority": job.priority,
+                    **({"refs": results["refs"]} if "refs" in results else {}),
+                },
+                default=str,
+            ),
+            self.worker_id,
+        )
+
+        self._start_detached(key, job, definition, results)
+
+    def _start_detached(self, key: str, job: Job, definition: PipelineDefinition, results: PipelinePayload) -> None:
+        task = asyncio.create_task(self._run_detached(key, job, definition, results))
+        self.detached_runs[key] = task
+        task.add_done_callback(lambda _: self.detached_runs.pop(key, None))
+
+    async def _run_detached(
+        self,
+        key: str,
+        job: Job,
+        definition: PipelineDefinition,
+        results: PipelinePayload,
+    ) -> None:
+        """
+        Execute a detached pipeline run (from its checkpoint) and store its result under the id of its job.
+
+        Steps run like in any other pipeline, including their `timeout` and `retries` options.
+        The checkpoint is only dropped after the result is stored, so when this worker dies in between,
+        another one adopts the run (and stores its result).
+        """
+        try:
+            await self._run_plan(
+                job,
+                definition.plan,
+                results,
+                checkpoint=key,
+                max_parallel=definition.max_parallel,
+                completion_boost=definition.completion_boost,
+                # only once the result is stored: until then, the run can still be adopted
+                drop_checkpoint=False,
+            )
+        except asyncio.CancelledError:
+            raise  # shutting down: the checkpoint stays, so the run can be adopted by another worker
+        except Exception as e:  # noqa: BLE001 - any failure must become the result of the run
+            print(f"Warn: detached pipeline `{job.entrypoint}` ({key}) failed", file=sys.stderr)
+            traceback.print_exception(e)
+            failure = {"exception": [type(e).__name__, str(e)]}
+            # store the result first: `result()` (and parent pipelines) wait for it, whatever happens after
+            await self._record_results(
+                [job.id], [job.entrypoint], [{"status": "exception", "ok": False, "result": failure}], [key]
+            )
+            await self._drop_checkpoint(key)
+            # the job itself already finished successfully, mark the run as failed
+            # (this also makes it the latest log entry of the job, after the `spawned` ones):
+            await self.log(job, "exception", failure)
+        else:
+            await self._record_results(
+                [job.id], [job.entrypoint], [{"status": "successful", "ok": True, "result": results}], [key]
+            )
+            await self._drop_checkpoint(key)
+            # the run logged `spawned` entries after the job finished: end with a terminal status again,
+            # since the status of a job is taken from its latest log entry
+            await self.log(job, "successful", None)
+
+    async def _adopt_detached(self) -> None:
+        """
+        Take over detached runs (of pipelines registered on this queuer) whose owner stopped sending heartbeats.
+
+        Runs whose result was stored already (their owner died before it could drop the checkpoint) are only cleaned up.
+        """
+        rows = await self.io.fetch(
+            """
+            UPDATE pgskewer_pipeline_checkpoint
+            SET owner   = $1,
+                updated = NOW()
+            WHERE unique_key IN (
+                SELECT unique_key
+                FROM pgskewer_pipeline_checkpoint
+                WHERE detached
+                  AND entrypoint = ANY($2)
+                  AND updated < NOW() - $3::interval
+                ORDER BY updated
+                LIMIT 100
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING unique_key, job_id, entrypoint, state;
+            """,
+            self.worker_id,
+            list(self.detached_pipelines),
+            self.detached_stale_after,
+        )
+
+        if not rows:
+            return
+
+        stored = await self.io.fetch(
+            "SELECT job_id FROM pgqueuer_result WHERE job_id = ANY($1);",
+            [row["job_id"] for row in rows],
+        )
+        finished = {record["job_id"] for record in stored}
+
+        for row in rows:
+            definition = self.detached_pipelines[row["entrypoint"]]
+            saved = safe_json(row["state"]) or {}
+            results: PipelinePayload = {
+                "initial": saved.get("initial"),
+                "pipeline": definition.meta | {"name": row["entrypoint"]},
+                "tasks": saved.get("tasks", {}),
+            }
+            if definition.by_reference:
+                results["refs"] = saved.get("refs", {})
+
+            if row["job_id"] in finished:
+                # its worker died right after storing the result: the run is done already
+                await self._drop_checkpoint(row["unique_key"])
+                continue
+
+            print(f"↪️ adopting detached run {row['unique_key']} of {row['entrypoint']}")
+            self._start_detached(
+                row["unique_key"],
+                _job_stub(row["job_id"], row["entrypoint"], priority=saved.get("priority", 0)),
+                definition,
+                results,
+            )
+
+    async def _supervise_detached(self) -> None:
+        """
+        Keep the detached runs of this queuer alive (heartbeat) and adopt abandoned ones, until shutdown.
+        """
+        while not self.shutdown.is_set():
+            if self.detached_runs:
+                await self.io.execute(
+                    """
+                    UPDATE pgskewer_pipeline_checkpoint
+                    SET updated = NOW()
+                    WHERE unique_key = ANY($1) AND owner = $2;
+                    """,
+                    list(self.detached_runs),
+                    self.worker_id,
+                )
+
+            await self._adopt_detached()
+
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self.shutdown.wait(), self.detached_heartbeat.total_seconds())
+
+    async def maintain_results(self) -> None:
+        """
+        Create the `pgqueuer_result` partitions for the coming days, and drop the ones older than `result_retention`
+        (together with the large result blobs of that age).
+
+        Dropping a whole partition is much cheaper than deleting (and vacuuming) its rows one by one.
+        """
+        await self.io.execute(
+            "SELECT pgskewer_maintain_results($1::interval);",
+            self.result_retention,
+        )
+
+        if self.result_retention is not None:
+            await self.io.execute(
+                "DELETE FROM pgskewer_result_blob WHERE created <= LOCALTIMESTAMP - $1::interval;",
+                self.result_retention,
+            )
+
+    async def rollup_log(self) -> int:
+        """
+        Roll up the new entries of `pgqueuer_log` (in batches of `log_rollup_batch_size`), and delete the
+        rolled up entries older than `log_retention`.
+
+        Counts per second go into `pgqueuer_statistics` (as shown by `pgq dashboard`), durations per minute
+        into the histograms of `pgskewer_log_durations` (see `log_durations()`).
+        Only one queuer at a time rolls up, the others return right away.
+
+        Returns:
+            How many log entries were rolled up.
+        """
+        await self.log_writer.flush()
+
+        total = 0
+        while True:
+            rows = await self.io.fetch(
+                "SELECT pgskewer_rollup_log($1, $2::interval) AS rolled_up;",
+                self.log_rollup_batch_size,
+                self.log_retention,
+            )
+            total += rows[0]["rolled_up"]
+            if rows[0]["rolled_up"] < self.log_rollup_batch_size:
+                return total
+
+    async def log_durations(self, last: dt.timedelta = dt.timedelta(hours=1)) -> list[dict[str, t.Any]]:
+        """
+        Duration percentiles (from being picked until done) per entrypoint and status, over the `last` period.
+
+        Based on the rolled up log (see `rollup_log()`), so this stays fast regardless of the size of `pgqueuer_log`.
+        Percentiles are accurate to about 20%.
+
+        Example:
+            >>> for row in await pgq.log_durations(dt.timedelta(minutes=15)):
+            ...     print(row["entrypoint"], row["status"], row["count"], row["p50"], row["p95"], row["p99"])
+        """
+        rows = await self.io.fetch(
+            "SELECT * FROM pgskewer_log_duration_percentiles(NOW() - $1::interval);",
+            last,
+        )
+        return [dict(row) for row in rows]
+
+    async def _periodically(self, action: t.Callable[[], t.Awaitable[t.Any]], interval: dt.timedelta) -> None:
+        """
+        Call `action` every `interval`, until shutdown.
+        """
+        while not self.shutdown.is_set():
+            try:
+                await action()
+            except Exception as e:  # noqa: BLE001 - a failed round is retried next interval, not fatal to the worker
+                print(f"Warn: {action.__name__} failed", file=sys.stderr)
+                traceback.print_exception(e)
+
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self.shutdown.wait(), interval.total_seconds())
+
+    async def run(self, *args: t.Any, **kwargs: t.Any) -> None:
+        """
+        Run the queuer (see `PgQueuer.run`), plus the supervision of detached pipeline runs.
+
+        Partitions of `pgqueuer_result` are created (and expired ones dropped) when starting, and periodically after.
+        `pgqueuer_log` is rolled up periodically too.
+        Either is skipped (once, with a warning) when the migration it depends on isn't applied yet.
+        On shutdown, buffered results are stored and unfinished detached runs are released,
+        so another worker can adopt them right away.
+        """
+        supervisor = asyncio.create_task(self._supervise_detached()) if self.detached_pipelines else None
+        rows = await self.io.fetch(
+            """
+            SELECT to_regproc('pgskewer_maintain_results') IS NOT NULL AS maintain_results,
+                   to_regproc('pgskewer_rollup_log') IS NOT NULL AS rollup_log;
+            """
+        )
+        maintenance = []
+        for action, interval in [
+            (self.maintain_results, self.result_maintenance_interval),
+            (self.rollup_log, self.log_rollup_interval),
+        ]:
+            if rows[0][action.__name__]:
+                maintenance.append(asyncio.create_task(self._periodically(action, interval)))
+            else:
+                print(f"Warn: skipping {action.__name__}, its migration isn't applied", file=sys.stderr)
+        try:
+            await super().run(*args, **kwargs)
+        finally:
+            for task in maintenance:
+                task.cancel()
+            if supervisor:
+                supervisor.cancel()
+
+            await self.result_writer.flush()
+            await self.log_writer.flush()
+
+            if keys := list(self.detached_runs):
+                for task in self.detached_runs.values():
+                    task.cancel()
+
+                await self.io.execute(
+                    """
+                    UPDATE pgskewer_pipeline_checkpoint
+                    SET owner   = NULL,
+                        updated = NOW() - $3::interval
+                    WHERE unique_key = ANY($1) AND owner = $2;
+                    """,
+                    keys,
+                    self.worker_id,
+                    self.detached_stale_after,
+                )
 
     def entrypoint_pipeline(
         self,
         name: str,
         *input_steps: InputStep,
         check: bool = True,
+        by_reference: bool = False,
+        resumable: bool = False,
+        max_parallel: int | None = None,
+        detached: bool = False,
+        flatten: bool = True,
+        completion_boost: int = 0,
+        retry_timer: dt.timedelta = dt.timedelta(seconds=0),
     ):
         """
         Register a pipeline as an entrypoint that can be queued like any other job.
@@ -580,23 +2272,43 @@ class ImprovedQueuer(PgQueuer):
             name: The entrypoint name for the pipeline.
             *input_steps: The steps to include in the pipeline (same as pipeline()).
             check: Whether to validate step names against the registry.
+            by_reference: Whether to pass results of earlier steps to substeps by reference (see pipeline()).
+            resumable: Whether to checkpoint progress, so an interrupted run can be resumed (see pipeline()).
+            max_parallel: Maximum number of jobs of one run that are in flight at the same time (see pipeline()).
+            detached: Whether runs continue in the background instead of occupying a worker (see pipeline()).
+            flatten: Whether steps that are pipelines themselves are run from this pipeline's job (see pipeline()).
+            completion_boost: Priority added to the substeps of runs that are (almost) done (see pipeline()).
+            retry_timer: Time after which a pipeline job whose worker stopped sending heartbeats is picked up again.
 
         Returns:
             A decorator that registers the pipeline as an entrypoint.
 
         Example:
             >>> pgq.entrypoint_pipeline("data_processing", "extract", ["transform", "validate"], "load")
+            >>> pgq.entrypoint_pipeline("etl", "extract", "load", resumable=True, retry_timer=dt.timedelta(minutes=1))
         """
 
-        return self.entrypoint(name)(self.pipeline(*input_steps, check=check))
+        return self.entrypoint(name, retry_timer=retry_timer)(
+            self.pipeline(
+                *input_steps,
+                check=check,
+                by_reference=by_reference,
+                resumable=resumable,
+                max_parallel=max_parallel,
+                detached=detached,
+                flatten=flatten,
+                completion_boost=completion_boost,
+            )
+        )
 
     async def result(self, job_id: int, timeout: t.Optional[int] = None) -> TaskResult | None:
         """
         Retrieve the stored result of a job by its ID.
 
-        This method polls the pgqueuer_result table to find the result of a
-        specific job. It will wait until the result is available or the timeout
-        is reached.
+        This method waits until the job's result is stored in the pgqueuer_result table
+        or the timeout is reached. Instead of polling, it is woken up by a notification
+        when the result is inserted (see `pgskewer_notify_results_001`); the table is only
+        re-checked every `result_poll_interval` in case a notification got lost.
 
         Args:
             job_id: The unique identifier of the job to retrieve results for.
@@ -614,45 +2326,310 @@ class ImprovedQueuer(PgQueuer):
             ...     print("Job failed or timed out")
         """
 
-        start_time = asyncio.get_event_loop().time()
+        async with contextlib.aclosing(self.results_many([job_id], timeout=timeout)) as task_results:
+            async for _, result in task_results:
+                return result
+
+        return None
+
+    async def results_many(
+        self,
+        job_ids: t.Iterable[int],
+        timeout: float | None = None,
+        load_blobs: bool = True,
+    ) -> t.AsyncIterator[tuple[int, TaskResult]]:
+        """
+        Retrieve the stored results of multiple jobs, yielding each one as soon as it lands.
+
+        All outstanding jobs are fetched with a single query (`job_id = ANY($1)`), which is only
+        repeated when one of them is notified to have a result (or every `result_poll_interval`,
+        in case a notification got lost).
+
+        Args:
+            job_ids: The ids of the jobs to retrieve results for.
+            timeout: Maximum time to wait for all results in seconds. None means wait indefinitely.
+            load_blobs: Load large results that were stored as a blob (see `load_result`).
+                If False, their `result` is the `BlobPointer` instead.
+
+        Yields:
+            `(job_id, TaskResult)` tuples, in the order the results become available.
+            Jobs without a result when the timeout is reached are not yielded.
+
+        Example:
+            >>> async for job_id, result in pgq.results_many([123, 124, 125], timeout=30):
+            ...     print(f"Job {job_id} finished with status {result['status']}")
+        """
+        pending = set(job_ids)
+        if not pending:
+            return
+
+        await self.result_listener.start()
+
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+
+        while pending:
+            # subscribe before querying, so a result stored in between can't be missed:
+            notified = {job_id: self.result_listener.wait_for(job_id) for job_id in pending}
+            try:
+                rows = await self.io.fetch(
+                    """
+                    SELECT job_id, ok, result, status
+                    FROM pgqueuer_result
+                    WHERE job_id = ANY($1)
+                    ;
+                    """,
+                    list(pending),
+                )
+
+                for row in rows:
+                    if row["job_id"] not in pending:
+                        continue  # duplicate result row
+
+                    pending.discard(row["job_id"])
+                    result = safe_json(row["result"])
+                    yield (
+                        row["job_id"],
+                        {
+                            "status": row["status"],
+                            "ok": row["ok"],
+                            "result": await self.load_result(result) if load_blobs else result,
+                        },
+                    )
+
+                if not pending:
+                    return
+
+                wait = self.result_poll_interval.total_seconds()
+                # Check if we've exceeded the timeout
+                if deadline is not None:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        return  # timeout reached
+
+                    # don't exceed the remaining timeout
+                    wait = min(wait, remaining)
+
+                await asyncio.wait(
+                    [notified[job_id] for job_id in pending], timeout=wait, return_when=asyncio.FIRST_COMPLETED
+                )
+            finally:
+                for job_id, fut in notified.items():
+                    self.result_listener.discard(job_id, fut)
+
+    async def load_result(self, result: t.Any) -> t.Any:
+        """
+        Load a large result that was stored as a blob (see `pgskewer.results`); other results are returned as-is.
+
+        Example:
+            >>> extracted = await pgq.load_result(payload["tasks"]["extract"]["result"])
+        """
+        if not is_blob(result):
+            return result
+
+        chunks = [chunk async for chunk in self.stream_result(result)]
+        return loads_json(b"".join(chunks))
+
+    async def _load_task_blobs(self, payload: t.Any, steps: t.Iterable[str] | None = None) -> t.Any:
+        """
+        Load the results of (the given, or all) tasks of a pipeline payload that were stored as a blob,
+        for the pipeline itself to use (e.g. to map over them). Returns a copy if anything was loaded.
+        """
+        if not isinstance(payload, dict) or not isinstance(payload.get("tasks"), dict):
+            return payload
+
+        tasks = payload["tasks"]
+        loaded = {}
+        for step in tasks if steps is None else steps:
+            if not isinstance(task := tasks.get(step), dict):
+                continue
+            result = task.get("result")
+            if is_blob(result):
+                loaded[step] = task | {"result": await self.load_result(result)}
+            elif isinstance(result, list) and any(map(is_blob, result)):
+                # the combined result of a map step, holding a pointer for every large unit result:
+                loaded[step] = task | {"result": [await self.load_result(item) for item in result]}
+
+        return payload | {"tasks": tasks | loaded} if loaded else payload
+
+    async def _plan_units(self, node: PlanStep, results: PipelinePayload) -> list[MapItem | None]:
+        """
+        `node.units()`, with the large results it maps over loaded first (pipelines only pass pointers to them).
+        """
+        if node.is_map:
+            over = t.cast(Step, node.options).over
+            # a path only needs the step it points into, a callable might read any:
+            steps = over.split(".")[1:2] if isinstance(over, str) and over.startswith("tasks.") else None
+            if not isinstance(over, str) or steps:
+                results = await self._load_task_blobs(results, steps)
+
+        return node.units(results)
+
+    async def stream_result(self, pointer: BlobPointer, chunk_size: int = 1 << 20) -> t.AsyncIterator[bytes]:
+        """
+        Stream a large result that was stored as a blob, as (decompressed) chunks of its JSON.
+
+        Only `chunk_size` compressed bytes are fetched per query, so the whole blob never has to be in memory.
+
+        Raises:
+            LookupError: if the blob doesn't exist (anymore, e.g. because of `result_retention`).
+
+        Example:
+            >>> async for chunk in pgq.stream_result(payload["tasks"]["extract"]["result"]):
+            ...     parser.feed(chunk)
+        """
+        blob_id = pointer["$pgskewer_blob"]
+        decompressor = COMPRESSION[pointer["compression"]][1]()
+        offset = 1  # substring() counts from 1
 
         while True:
-            # Query the database for results
-            rows = await self.connection.fetch(
-                """
-                SELECT ok, result, status
-                FROM pgqueuer_result
-                WHERE job_id = $1
-                ;
-                """,
-                job_id,
+            rows = await self.io.fetch(
+                "SELECT substring(data FROM $2 FOR $3) AS chunk FROM pgskewer_result_blob WHERE id = $1;",
+                blob_id,
+                offset,
+                chunk_size,
             )
+            if not rows:
+                raise LookupError(f"Result blob {blob_id} doesn't exist (anymore)")
 
-            # If we found results, return them
-            if rows:
-                row = rows[0]
-                result: TaskResult = {
-                    "status": row["status"],
-                    "ok": row["ok"],
-                    "result": safe_json(row["result"]),
-                }
-                return result
+            chunk = rows[0]["chunk"]
+            if data := decompressor.decompress(chunk):
+                yield data
 
-            # Check if we've exceeded the timeout
-            if timeout is not None:  # todo: pytests?
-                elapsed = asyncio.get_event_loop().time() - start_time
-                if elapsed >= timeout:
-                    return None  # Return None if timeout reached
+            if len(chunk) < chunk_size:
+                break
 
-                # Wait a bit before trying again, but don't exceed the remaining timeout
-                remaining = timeout - elapsed
-                await asyncio.sleep(min(0.1, remaining))
-            else:
-                # No timeout specified, wait a bit before trying again
-                await asyncio.sleep(0.1)
+            offset += chunk_size
+
+        if data := decompressor.flush():
+            yield data
+
+    async def resolve_tasks(self, payload: PipelinePayload, *steps: str) -> PipelinePayload:
+        """
+        Load the results of earlier pipeline steps that were passed by reference.
+
+        Results of all referenced steps (or only `steps`, if given) that are not in `payload["tasks"]` yet
+        are fetched with a single query and added to it. Payloads without references are returned as-is.
+        Large results that were stored as a blob are added as their `BlobPointer` (see `task_result`).
+
+        Args:
+            payload: The (parsed) payload of a pipeline substep.
+            *steps: Names of the steps to load. Loads all referenced steps by default.
+
+        Returns:
+            The same payload, with the requested tasks filled in.
+
+        Example:
+            >>> payload = await pgq.resolve_tasks(parse_payload(job.payload))
+            >>> payload["tasks"]["extract"]["result"]
+        """
+        refs = payload.get("refs", {})
+        missing = {step: refs[step] for step in (steps or refs) if step in refs and step not in payload["tasks"]}
+        job_ids = [job_id for ref in missing.values() for job_id in (ref if isinstance(ref, list) else [ref])]
+
+        task_results = self.results_many(job_ids, timeout=0, load_blobs=False)
+        async with contextlib.aclosing(task_results) as task_results:
+            fetched = {job_id: task_result async for job_id, task_result in task_results}
+
+        for step, ref in missing.items():
+            if isinstance(ref, list):
+                # map step: one result per element (or chunk)
+                payload["tasks"][step] = _map_result([fetched.get(job_id) for job_id in ref])
+            elif ref in fetched:
+                payload["tasks"][step] = fetched[ref]
+
+        return payload
+
+    async def task_result(self, payload: PipelinePayload, step: str) -> TaskResult | None:
+        """
+        Get the result of an earlier pipeline step, whether it was passed inline or by reference,
+        and whether it was stored as a blob or not.
+
+        Args:
+            payload: The (parsed) payload of a pipeline substep.
+            step: The name of the earlier step.
+
+        Returns:
+            The TaskResult of that step, or None if it didn't run (yet).
+
+        Example:
+            >>> extracted = await pgq.task_result(parse_payload(job.payload), "extract")
+        """
+        await self.resolve_tasks(payload, step)
+        task = payload["tasks"].get(step)
+        if task is None:
+            return None
+
+        result = task["result"]
+        if isinstance(result, list) and any(is_blob(unit) for unit in result):
+            # map step: one result per element (or chunk)
+            result = [await self.load_result(unit) for unit in result]
+        else:
+            result = await self.load_result(result)
+
+        return {**task, "result": result}
+
+    async def enqueue(
+        self,
+        entrypoint: str,
+        payload: str | bytes | dict,
+        priority: int = 10,
+        execute_after: dt.datetime | None = None,
+        unique_key: str | uuid.UUID | None = None,
+        dill: bool = False,
+    ) -> EnqueuedJob:
+        """
+        Queue a job (see `pgskewer.helpers.queue_job`), without blocking the event loop.
+
+        Unlike `qm.queries.enqueue`, the job gets a unique key (UUID7 by default) and codec headers,
+        so `cancel_run`, `result` and pipelines treat it like a job queued with `queue_job`.
+        For many jobs at once, use `pgskewer.helpers.queue_jobs_async(pgq.io, ...)`.
+
+        Example:
+            >>> job = await pgq.enqueue("process", {"url": "..."})
+            >>> result = await pgq.result(job.id, timeout=30)
+        """
+        return await queue_job_async(
+            self.io,
+            entrypoint,
+            payload,
+            priority=priority,
+            execute_after=execute_after,
+            unique_key=unique_key,
+            dill=dill,
+        )
+
+    def use_pool(self, pool: asyncpg.Pool) -> None:
+        """
+        Do all I/O besides dequeueing and listening (see `io`) over a connection pool.
+
+        With a single connection, storing results, logging and enqueueing substeps all wait for each other
+        and for the dequeue loop, so more concurrency on a worker doesn't raise its throughput.
+        `connection` stays dedicated to LISTEN and dequeueing.
+
+        Raises:
+            RuntimeError: if the pool can't hold at least 2 connections.
+
+        Example:
+            >>> pgq.use_pool(await asyncpg.create_pool(uri, max_size=10))
+        """
+        if pool.get_max_size() < 2:
+            raise RuntimeError(
+                f"use_pool() needs a pool of at least 2 connections (got max_size={pool.get_max_size()})"
+            )
+
+        self.io = AsyncpgPoolDriver(pool)
+        self.queries = Queries(self.io)
+        self.log_writer.driver = self.io
+        self.result_writer.driver = self.io
 
     @classmethod
-    async def from_env(cls, key: str = "POSTGRES_URI") -> t.Self:
+    async def from_env(
+        cls,
+        key: str = "POSTGRES_URI",
+        pool_size: int | None = None,
+        pool_min_size: int = 1,
+    ) -> t.Self:
         """
         Create an ImprovedQueuer instance from environment variables.
 
@@ -662,6 +2639,9 @@ class ImprovedQueuer(PgQueuer):
         Args:
             key: The environment variable name containing the PostgreSQL URI.
                 Defaults to "POSTGRES_URI".
+            pool_size: Maximum number of pooled connections for results, logs and enqueueing (see `use_pool()`),
+                next to the dedicated connection for dequeueing. None (default) uses that one connection for everything.
+            pool_min_size: Number of pooled connections that are kept open.
 
         Returns:
             A new ImprovedQueuer instance connected to the specified database.
@@ -675,13 +2655,21 @@ class ImprovedQueuer(PgQueuer):
             >>> pgq = await ImprovedQueuer.from_env()
             >>> # Or use a custom environment variable
             >>> pgq = await ImprovedQueuer.from_env("DATABASE_URL")
+            >>> # With up to 10 pooled connections for I/O
+            >>> pgq = await ImprovedQueuer.from_env(pool_size=10)
         """
 
         connection = await asyncpg.connect(
             os.getenv(key),
         )
         driver = AsyncpgDriver(connection)
-        return cls(driver)
+        queuer = cls(driver)
+
+        if pool_size is not None:
+            pool = await asyncpg.create_pool(os.getenv(key), min_size=min(pool_min_size, pool_size), max_size=pool_size)
+            queuer.use_pool(pool)
+
+        return queuer
 
 
 def _serialize_callable_and_args(sync_fn: t.Callable[..., t.Any], args: tuple[t.Any, ...]) -> tuple[bytes, bytes]:
@@ -888,7 +2876,7 @@ async def unblock[**P, R](sync_fn: t.Callable[P, R], *args: P.args, logs: bool =
 
 @t.overload
 def parse_payload[T](
-    data: bytes | str | None,
+    data: Job | bytes | str | None,
     strict: t.Literal[False],
     as_type: type[T],
 ) -> T | None: ...
@@ -896,48 +2884,66 @@ def parse_payload[T](
 
 @t.overload
 def parse_payload[T](
-    data: bytes | str | None,
+    data: Job | bytes | str | None,
     strict: t.Literal[True],
     as_type: type[T],
 ) -> T: ...
 
 
 @t.overload
-def parse_payload(data: bytes | str | None, strict: t.Literal[False] = False) -> PipelinePayload | None: ...
+def parse_payload(data: Job | bytes | str | None, strict: t.Literal[False] = False) -> PipelinePayload | None: ...
 
 
 @t.overload
-def parse_payload(data: bytes | str | None, strict: t.Literal[True]) -> PipelinePayload: ...
+def parse_payload(data: Job | bytes | str | None, strict: t.Literal[True]) -> PipelinePayload: ...
 
 
 def parse_payload[T](
-    data: bytes | str | None,
+    data: Job | bytes | str | None,
     strict: bool = False,
     as_type: type[T] | None = None,
 ) -> T | None:
     """
     Parse job payload data into a typed payload structure.
 
-    This function is a convenience wrapper around safe_json() specifically
-    for parsing pipeline payload data. By default it returns
-    `PipelinePayload | None`, but callers can override this with a
+    This function decodes payload data specifically for parsing pipeline payload data.
+    By default it returns `PipelinePayload | None`, but callers can override this with a
     custom type parameter.
 
+    Pass the `Job` itself (instead of `job.payload`) to decode with the codec named in its headers
+    (see `pgskewer.codecs`). Without headers, the codec is guessed: pickled payloads are loaded
+    with dill, anything else is parsed as JSON.
+
     Args:
-        data: The payload data to parse (bytes, string, or None).
+        data: The job, or the payload data to parse (bytes, string, or None).
         strict: raise exception if data is None
         as_type: Static typing hint for callers that expect a specific payload type.
 
     Returns:
         The parsed payload, or None if parsing fails.
 
+    Raises:
+        ValueError: if the job headers name a codec that is not registered.
+
     Example:
         >>> payload_data = '{"initial": {"id": 1}, "tasks": {}}'
         >>> payload = parse_payload(payload_data)
         >>> print(payload["initial"])  # {"id": 1}
+        >>> payload = parse_payload(job)
     """
 
-    parsed = safe_dill(data) or safe_json(data)
+    headers = None
+    if isinstance(data, Job):
+        data, headers = data.payload, data.headers
+
+    parsed = None
+    if data:
+        codec = payload_codec(data, headers)
+        try:
+            parsed = codec.decode(data)
+        except Exception:  # noqa: BLE001
+            # decoders raise all kinds of errors for invalid input (ValueError, UnpicklingError, EOFError, ...)
+            parsed = None
 
     if parsed is None and strict:
         raise ValueError("parsed_payload encountered None value with strict=True")
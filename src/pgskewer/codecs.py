@@ -0,0 +1,169 @@
+"""
+Payload codecs: how job payloads are serialized, and how to tell later which serialization was used.
+
+Every encoded payload comes with job headers (stored in the `headers` JSONB column of `pgqueuer`)
+that name its codec, so decoding can dispatch straight to the right decoder instead of trying them in turn.
+
+Built-in codecs:
+- `json`: JSON (using `orjson` when it is installed, otherwise the standard library)
+- `dill`: binary serialization of (almost) any Python object
+- `msgpack`: only available when `msgpack` is installed
+"""
+
+import dataclasses as dc
+import json
+import math
+import typing as t
+
+import dill
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+CODEC_HEADER = "codec"
+
+# first byte of a pickle (and thus dill) payload, for protocol 2 and up
+PICKLE_PROTO = b"\x80"
+
+
+@dc.dataclass(frozen=True)
+class Codec:
+    """
+    A named pair of payload encode/decode functions.
+
+    Attributes:
+        name: Identity of the codec, written into the job headers.
+        encode: Serialize a Python object to bytes.
+        decode: Deserialize bytes back into a Python object.
+    """
+
+    name: str
+    encode: t.Callable[[t.Any], bytes]
+    decode: t.Callable[[bytes], t.Any]
+
+
+CODECS: dict[str, Codec] = {}
+
+
+def register_codec(name: str, encode: t.Callable[[t.Any], bytes], decode: t.Callable[[bytes], t.Any]) -> Codec:
+    """
+    Register (or replace) a payload codec.
+
+    Example:
+        >>> register_codec("cbor", cbor2.dumps, cbor2.loads)
+        >>> pgq.payload_codec = "cbor"
+    """
+    codec = CODECS[name] = Codec(name, encode, decode)
+    return codec
+
+
+def get_codec(name: str) -> Codec:
+    """
+    Look up a registered codec by name.
+
+    Raises:
+        ValueError: if no codec with that name is registered (e.g. its optional dependency is missing).
+    """
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(f"Unknown payload codec '{name}', choose from {sorted(CODECS)}") from None
+
+
+def dumps_json(data: t.Any, default: t.Callable[[t.Any], t.Any] | None = None, sort_keys: bool = False) -> str:
+    """
+    Serialize to a (compact) JSON string, with `orjson` if available.
+
+    Like `json.dumps`, this raises a TypeError for objects that can't be serialized (unless `default` handles them).
+    The output doesn't depend on whether `orjson` is installed: datetimes and dataclasses are passed to `default`
+    (as the standard library does), and whatever `orjson` can't encode the same way (ints wider than 64 bits,
+    NaN and Infinity) is encoded by the standard library.
+    """
+    if orjson is not None:
+        option = (
+            orjson.OPT_NON_STR_KEYS
+            | orjson.OPT_PASSTHROUGH_DATETIME
+            | orjson.OPT_PASSTHROUGH_DATACLASS
+            | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        )
+        try:
+            encoded = orjson.dumps(data, default=default, option=option)
+        except orjson.JSONEncodeError:
+            pass  # e.g. a big int, or `default` failed: the standard library decides
+        else:
+            # orjson writes NaN and Infinity as null:
+            if b"null" not in encoded or not _has_non_finite(data):
+                return encoded.decode()
+
+    return json.dumps(data, default=default, sort_keys=sort_keys, separators=(",", ":"), ensure_ascii=False)
+
+
+def _has_non_finite(data: t.Any) -> bool:
+    """
+    Whether (nested) data contains a NaN or infinite float.
+    """
+    if isinstance(data, float):
+        return not math.isfinite(data)
+    if isinstance(data, dict):
+        return any(_has_non_finite(value) for value in data.values())
+    if isinstance(data, (list, tuple)):
+        return any(_has_non_finite(value) for value in data)
+    return False
+
+
+def loads_json(data: bytes | str) -> t.Any:
+    """
+    Deserialize a JSON string or bytes, with `orjson` if available.
+
+    Raises:
+        ValueError: for invalid JSON.
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass  # e.g. NaN, which the standard library does accept
+
+    return json.loads(data)
+
+
+register_codec("json", lambda data: dumps_json(data).encode(), loads_json)
+register_codec("dill", dill.dumps, dill.loads)
+
+if msgpack is not None:  # pragma: no cover
+    register_codec("msgpack", msgpack.packb, msgpack.unpackb)
+
+
+def encode_payload(data: t.Any, codec: str = "json") -> tuple[bytes, dict[str, str]]:
+    """
+    Encode a payload with the given codec.
+
+    Returns:
+        The encoded payload and the job headers identifying its codec.
+
+    Example:
+        >>> payload, headers = encode_payload({"key": "value"})
+        >>> await queries.enqueue("my_task", payload, headers=headers)
+    """
+    return get_codec(codec).encode(data), {CODEC_HEADER: codec}
+
+
+def payload_codec(data: bytes | str, headers: t.Mapping[str, str] | None = None) -> Codec:
+    """
+    Determine the codec of a payload: from its job headers or, for payloads without codec header
+    (e.g. enqueued by an older version or by hand), by checking whether it looks like a pickle.
+    """
+    if headers and (name := headers.get(CODEC_HEADER)):
+        return get_codec(name)
+
+    if isinstance(data, bytes) and data.startswith(PICKLE_PROTO):
+        return CODECS["dill"]
+
+    return CODECS["json"]
@@ -0,0 +1,132 @@
+"""
+Long-lived job completion tracking, shared by all pipelines running on one `ImprovedQueuer`.
+"""
+
+import asyncio
+import dataclasses as dc
+import json
+from collections import defaultdict
+
+from pgqueuer import db
+from pgqueuer.completion import CompletionWatcher
+
+
+@dc.dataclass
+class CompletionHub(CompletionWatcher):
+    """
+    A `CompletionWatcher` that stays subscribed for the lifetime of its queuer.
+
+    pgqueuer's watcher is meant to be used as a short-lived context manager. Opening one for every
+    pipeline stage costs a LISTEN subscription (which the driver never removes) and a polling task per stage,
+    and every subscription triggers its own status query on each notification.
+    The hub is started once and multiplexes the waits of all in-flight pipelines over a single listener
+    and a single (debounced) status query.
+
+    Example:
+        >>> await hub.start()
+        >>> status = await hub.wait_for(job_id)
+    """
+
+    _started: asyncio.Task[CompletionWatcher] | None = dc.field(default=None, init=False, repr=False)
+
+    async def start(self) -> None:
+        """
+        Subscribe to job changes, if that hasn't happened yet. Safe to call concurrently and repeatedly.
+        """
+        if self._started is None:
+            self._started = asyncio.create_task(self.__aenter__())
+
+        await asyncio.shield(self._started)
+
+    async def _refresh_waiters(self) -> None:
+        """
+        Resolve the futures of all jobs that reached a terminal state.
+
+        Unlike the base implementation, this skips the status query when nobody is waiting,
+        and drops futures that were cancelled by their waiter (e.g. a pipeline that failed or timed out)
+        instead of trying to resolve them.
+        """
+        for jid in [jid for jid, waiters in self.waiters.items() if all(w.done() for w in waiters)]:
+            del self.waiters[jid]
+
+        if not self.waiters:
+            return
+
+        async with self.lock:
+            for jid, status in await self.q.job_status(list(self.waiters.keys())):
+                if self._is_terminal(status):
+                    for waiter in self.waiters.pop(jid, []):
+                        if not waiter.done():
+                            waiter.set_result(status)
+
+
+RESULT_CHANNEL = "ch_pgskewer_result"
+
+
+@dc.dataclass
+class ResultHub:
+    """
+    Wakes up coroutines waiting for the result of a job as soon as that result is stored.
+
+    The `pgskewer_notify_results_001` migration adds a trigger that sends the ids of all jobs inserted into
+    `pgqueuer_result` (as a JSON list) on the `ch_pgskewer_result` channel.
+    Only the waiters for those job ids are resolved, so waiting for a result costs no queries at all
+    until it actually lands. Callers should still re-check the table every now and then,
+    since notifications can get lost (e.g. when the connection drops).
+
+    Example:
+        >>> await hub.start()
+        >>> notified = hub.wait_for(job_id)
+        >>> # ... check whether the result already exists, otherwise:
+        >>> await notified
+    """
+
+    driver: db.Driver
+    channel: str = RESULT_CHANNEL
+
+    waiters: defaultdict[int, list[asyncio.Future[None]]] = dc.field(
+        default_factory=lambda: defaultdict(list),
+        init=False,
+        repr=False,
+    )
+    _started: asyncio.Task[None] | None = dc.field(default=None, init=False, repr=False)
+
+    async def start(self) -> None:
+        """
+        Subscribe to result notifications, if that hasn't happened yet. Safe to call concurrently and repeatedly.
+        """
+        if self._started is None:
+            self._started = asyncio.create_task(self.driver.add_listener(self.channel, self._on_notify))
+
+        await asyncio.shield(self._started)
+
+    def wait_for(self, job_id: int) -> asyncio.Future[None]:
+        """
+        Return a Future that resolves when a result for `job_id` has been stored.
+        """
+        fut: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self.waiters[job_id].append(fut)
+        return fut
+
+    def discard(self, job_id: int, fut: asyncio.Future[None]) -> None:
+        """
+        Stop waiting: remove (and cancel) a Future obtained through `wait_for`.
+        """
+        fut.cancel()
+        waiters = self.waiters.get(job_id, [])
+        if fut in waiters:
+            waiters.remove(fut)
+        if not waiters:
+            self.waiters.pop(job_id, None)
+
+    def _on_notify(self, payload: str | bytes | bytearray) -> None:
+        """LISTEN/NOTIFY callback – resolves the waiters of every job id in the payload."""
+        try:
+            job_ids = json.loads(payload)
+        except ValueError:
+            return
+
+        for job_id in job_ids:
+            for waiter in self.waiters.pop(job_id, []):
+                if not waiter.done():
+                    waiter.set_result(None)
@@ -1,15 +1,21 @@
 import dataclasses as dc
 import datetime as dt
-import json
 import typing as t
 import uuid
 from pickle import UnpicklingError
 
-from dill import dumps as dill_encode
 from dill import loads as dill_decode
 from edwh_uuid7 import uuid7
+from pgqueuer.db import Driver
+from pgqueuer.errors import DuplicateJobError
+from pgqueuer.queries import is_unique_violation
 from pydal import DAL
 
+from .codecs import dumps_json, encode_payload, loads_json
+
+# job header that carries the unique key (`dedupe_key`) of a job, so workers don't have to look it up:
+UNIQUE_KEY_HEADER = "unique_key"
+
 
 def utcnow():
     return dt.datetime.now(dt.UTC)
@@ -23,6 +29,22 @@ class EnqueuedJob:
     _db: DAL = None
 
 
+def _encode_job(
+    payload: str | bytes | dict, unique_key: str | uuid.UUID, dill: bool
+) -> tuple[str | bytes, dict[str, str]]:
+    """
+    Encode the payload of a job, and build the headers that identify its codec and unique key.
+    """
+    if isinstance(payload, (str, bytes)):
+        # raw
+        encoded_payload, headers = payload, {}
+    else:
+        encoded_payload, headers = encode_payload(payload, "dill" if dill else "json")
+
+    headers[UNIQUE_KEY_HEADER] = str(unique_key)
+    return encoded_payload, headers
+
+
 def queue_job(
     db: DAL,
     entrypoint: str,
@@ -51,24 +73,19 @@ def queue_job(
 
     execute_after = execute_after or utcnow()
 
-    if isinstance(payload, (str, bytes)):
-        # raw
-        encoded_payload = payload
-    elif dill:
-        encoded_payload = dill_encode(payload)
-    else:
-        encoded_payload = json.dumps(payload)
+    encoded_payload, headers = _encode_job(payload, unique_key, dill)
 
     # Insert the job
     result = db.executesql(
         """
         INSERT INTO pgqueuer
-            (priority, entrypoint, payload, execute_after, dedupe_key, status)
+            (priority, entrypoint, payload, execute_after, dedupe_key, headers, status)
         VALUES (%(priority)s,
                 %(entrypoint)s,
                 %(payload)s,
                 %(execute_after)s,
                 %(unique_key)s,
+                %(headers)s,
                 'queued')
         RETURNING id;
     """,
@@ -78,6 +95,7 @@ def queue_job(
             "payload": encoded_payload,
             "unique_key": str(unique_key),
             "execute_after": execute_after,
+            "headers": dumps_json(headers),
         },
     )
 
@@ -104,6 +122,190 @@ def queue_job(
     return EnqueuedJob(job_id, unique_key, db)
 
 
+def queue_jobs(
+    db: DAL,
+    entrypoint: str,
+    payloads: t.Sequence[str | bytes | dict],
+    priority: int = 10,
+    execute_after: dt.datetime | None = None,
+    unique_keys: t.Sequence[str | uuid.UUID] | None = None,
+    dill: bool = False,
+) -> list[EnqueuedJob]:
+    """
+    Queue many jobs for the same entrypoint at once, like `queue_job` but with a single statement and commit.
+
+    The jobs and their pgqueuer_log entries are inserted together (with a data-modifying CTE),
+    so enqueueing thousands of jobs costs one round trip instead of two per job.
+
+    Parameters:
+        db: A database connection object with an `executesql` method.
+        entrypoint (str): The job entrypoint to execute.
+        payloads: Payload per job.
+        priority (int, optional): Priority of all jobs (default is 10).
+        execute_after (datetime, optional): When to execute the jobs. Defaults to datetime.now().
+        unique_keys: Unique key per job (see `queue_job`). Defaults to a new UUID7 per job.
+        dill: use binary serialization instead of json?
+
+    Returns:
+        The queued jobs, in the order of `payloads`.
+
+    Raises:
+        ValueError: if the number of unique keys doesn't match the number of payloads.
+
+    Example:
+        >>> jobs = queue_jobs(db, "thumbnail", [{"url": url} for url in urls])
+    """
+    if unique_keys is None:
+        unique_keys = [uuid7() for _ in payloads]
+    elif len(unique_keys) != len(payloads):
+        raise ValueError(f"Got {len(unique_keys)} unique keys for {len(payloads)} payloads")
+
+    if not payloads:
+        return []
+
+    encoded = [_encode_job(payload, key, dill) for payload, key in zip(payloads, unique_keys)]
+
+    rows = db.executesql(
+        """
+        WITH jobs AS (
+            INSERT INTO pgqueuer
+                (priority, entrypoint, payload, execute_after, dedupe_key, headers, status)
+            SELECT %(priority)s,
+                   %(entrypoint)s,
+                   job.payload,
+                   %(execute_after)s,
+                   job.unique_key,
+                   job.headers::JSONB,
+                   'queued'
+            FROM unnest(%(payloads)s::BYTEA[], %(unique_keys)s::TEXT[], %(headers)s::TEXT[])
+                AS job (payload, unique_key, headers)
+            RETURNING id, dedupe_key
+        ),
+        logged AS (
+            INSERT INTO pgqueuer_log
+                (job_id, status, entrypoint, priority)
+            SELECT id, 'queued', %(entrypoint)s, %(priority)s
+            FROM jobs
+        )
+        SELECT id, dedupe_key
+        FROM jobs;
+    """,
+        placeholders={
+            "priority": priority,
+            "entrypoint": entrypoint,
+            "execute_after": execute_after or utcnow(),
+            "payloads": [payload.encode() if isinstance(payload, str) else payload for payload, _ in encoded],
+            "unique_keys": [str(key) for key in unique_keys],
+            "headers": [dumps_json(headers) for _, headers in encoded],
+        },
+    )
+    db.commit()
+
+    # RETURNING doesn't keep the input order:
+    job_ids = {key: job_id for job_id, key in rows}
+    return [EnqueuedJob(job_ids[str(key)], key, db) for key in unique_keys]
+
+
+async def queue_job_async(
+    driver: Driver,
+    entrypoint: str,
+    payload: str | bytes | dict,
+    priority: int = 10,
+    execute_after: dt.datetime | None = None,
+    unique_key: str | uuid.UUID | None = None,
+    dill: bool = False,
+) -> EnqueuedJob:
+    """
+    Queue a job and log it in pgqueuer_log, like `queue_job` but on an async (pgqueuer) driver.
+
+    Example:
+        >>> job = await queue_job_async(AsyncpgDriver(connection), "thumbnail", {"url": url})
+    """
+    [job] = await queue_jobs_async(
+        driver,
+        entrypoint,
+        [payload],
+        priority=priority,
+        execute_after=execute_after,
+        unique_keys=None if unique_key is None else [unique_key],
+        dill=dill,
+    )
+    return job
+
+
+async def queue_jobs_async(
+    driver: Driver,
+    entrypoint: str,
+    payloads: t.Sequence[str | bytes | dict],
+    priority: int = 10,
+    execute_after: dt.datetime | None = None,
+    unique_keys: t.Sequence[str | uuid.UUID] | None = None,
+    dill: bool = False,
+) -> list[EnqueuedJob]:
+    """
+    Queue many jobs for the same entrypoint at once, like `queue_jobs` but on an async (pgqueuer) driver.
+
+    The jobs and their pgqueuer_log entries are inserted with a single statement (the same one as `queue_jobs`).
+    A naive `execute_after` is taken as UTC, like `utcnow()`.
+
+    Raises:
+        ValueError: if the number of unique keys doesn't match the number of payloads.
+        pgqueuer.errors.DuplicateJobError: if a job with one of the unique keys is already queued.
+
+    Example:
+        >>> jobs = await queue_jobs_async(pgq.io, "thumbnail", [{"url": url} for url in urls])
+    """
+    if unique_keys is None:
+        unique_keys = [uuid7() for _ in payloads]
+    elif len(unique_keys) != len(payloads):
+        raise ValueError(f"Got {len(unique_keys)} unique keys for {len(payloads)} payloads")
+
+    if not payloads:
+        return []
+
+    encoded = [_encode_job(payload, key, dill) for payload, key in zip(payloads, unique_keys)]
+
+    execute_after = execute_after or utcnow()
+    if execute_after.tzinfo is None:
+        # like `utcnow()` without a timezone (asyncpg needs one for TIMESTAMPTZ):
+        execute_after = execute_after.replace(tzinfo=dt.UTC)
+
+    try:
+        rows = await driver.fetch(
+            """
+            WITH jobs AS (
+                INSERT INTO pgqueuer
+                    (priority, entrypoint, payload, execute_after, dedupe_key, headers, status)
+                SELECT $1, $2, job.payload, $3, job.unique_key, job.headers::JSONB, 'queued'
+                FROM unnest($4::BYTEA[], $5::TEXT[], $6::TEXT[]) AS job (payload, unique_key, headers)
+                RETURNING id, dedupe_key
+            ),
+            logged AS (
+                INSERT INTO pgqueuer_log
+                    (job_id, status, entrypoint, priority)
+                SELECT id, 'queued', $2, $1
+                FROM jobs
+            )
+            SELECT id, dedupe_key
+            FROM jobs;
+            """,
+            priority,
+            entrypoint,
+            execute_after,
+            [payload.encode() if isinstance(payload, str) else payload for payload, _ in encoded],
+            [str(key) for key in unique_keys],
+            [dumps_json(headers) for _, headers in encoded],
+        )
+    except Exception as e:
+        if is_unique_violation(e):
+            raise DuplicateJobError([str(key) for key in unique_keys]) from e
+        raise
+
+    # RETURNING doesn't keep the input order:
+    job_ids = {row["dedupe_key"]: row["id"] for row in rows}
+    return [EnqueuedJob(job_ids[str(key)], key) for key in unique_keys]
+
+
 def safe_json(data: bytes | str | None) -> t.Any | None:
     """
     Safely parse JSON data with error handling.
@@ -132,11 +334,9 @@ def safe_json(data: bytes | str | None) -> t.Any | None:
     if not data:
         return None
 
-    data = data.decode() if isinstance(data, bytes) else data
-
     try:
-        return json.loads(data)
-    except (TypeError, ValueError, json.decoder.JSONDecodeError):
+        return loads_json(data)
+    except (TypeError, ValueError):
         return None
 
 
@@ -0,0 +1,119 @@
+"""
+Buffered writes to `pgqueuer_log`.
+
+Pipelines log an entry for every batch of substeps they spawn, so logging sits on their hot path.
+Instead of an INSERT (and a round trip over the shared connection) per entry, entries are collected
+and stored with a single multi-row insert.
+"""
+
+import asyncio
+import dataclasses as dc
+import datetime as dt
+import sys
+import traceback
+import typing as t
+
+from pgqueuer import db
+
+from .codecs import dumps_json
+
+# (created, job_id, status, priority, entrypoint, traceback):
+type LogRow = tuple[dt.datetime, int, str, int, str, str]
+
+
+@dc.dataclass
+class LogWriter:
+    """
+    Collects `pgqueuer_log` entries and stores them in batches, in the background.
+
+    `write()` only adds an entry to a buffer (with its own timestamp, so `created` still reflects when it was logged),
+    which is flushed once it holds `max_rows` entries or `max_delay` after the first entry was added.
+    When the database falls behind and `max_pending` entries are waiting to be stored,
+    `write()` waits for a flush to finish first, so memory use stays bounded.
+
+    Logging is best-effort: when a flush fails, its entries are stored one by one,
+    and only the ones that still fail are dropped (with a warning).
+
+    Example:
+        >>> writer = LogWriter(driver)
+        >>> await writer.write(job.id, "spawned", job.priority, job.entrypoint, [124, 125])
+        >>> await writer.flush()  # on shutdown
+    """
+
+    driver: db.Driver
+    max_delay: dt.timedelta = dt.timedelta(milliseconds=10)
+    max_rows: int = 1000
+    max_pending: int = 10_000
+
+    _buffer: list[LogRow] = dc.field(default_factory=list, init=False, repr=False)
+    _in_flight: int = dc.field(default=0, init=False, repr=False)
+    _timer: asyncio.Task[None] | None = dc.field(default=None, init=False, repr=False)
+    _flushes: set[asyncio.Task[None]] = dc.field(default_factory=set, init=False, repr=False)
+
+    async def write(self, job_id: int, status: str, priority: int, entrypoint: str, data: str | t.Any) -> None:
+        """
+        Add an entry to the log; it is stored together with the entries logged around the same time.
+        """
+        while self._flushes and len(self._buffer) + self._in_flight >= self.max_pending:
+            # back-pressure: wait for the database to catch up
+            await asyncio.wait(set(self._flushes), return_when=asyncio.FIRST_COMPLETED)
+
+        data = data if isinstance(data, str) else dumps_json(data)
+        self._buffer.append((dt.datetime.now(dt.UTC), job_id, status, priority, entrypoint, data))
+
+        if len(self._buffer) >= self.max_rows:
+            self._flush_in_background()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    def _flush_in_background(self) -> None:
+        if self._timer is not None and self._timer is not asyncio.current_task():
+            self._timer.cancel()
+        self._timer = None
+
+        batch, self._buffer = self._buffer, []
+        if not batch:
+            return
+
+        self._in_flight += len(batch)
+        flush = asyncio.create_task(self._store(batch))
+        self._flushes.add(flush)
+        flush.add_done_callback(self._flushes.discard)
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.max_delay.total_seconds())
+        self._flush_in_background()
+
+    async def _store(self, batch: list[LogRow]) -> None:
+        try:
+            if not await self._insert(batch) and len(batch) > 1:
+                # one bad entry (e.g. a traceback that isn't valid JSON) shouldn't cost the others: retry one by one
+                for row in batch:
+                    await self._insert([row])
+        finally:
+            self._in_flight -= len(batch)
+
+    async def _insert(self, batch: list[LogRow]) -> bool:
+        try:
+            await self.driver.execute(
+                """
+                INSERT INTO pgqueuer_log (created, job_id, status, priority, entrypoint, traceback)
+                SELECT *
+                FROM unnest($1::timestamptz[], $2::bigint[], $3::pgqueuer_status[], $4::int[], $5::text[], $6::jsonb[]);
+                """,
+                *map(list, zip(*batch)),
+            )
+        except Exception as e:  # noqa: BLE001 - logging is best-effort, whatever the driver raises
+            print(f"Warn: storing {len(batch)} pgqueuer_log entries failed", file=sys.stderr)
+            traceback.print_exception(e)
+            return False
+        return True
+
+    async def flush(self) -> None:
+        """
+        Store all buffered entries now, and wait until everything logged so far is stored
+        (e.g. on shutdown, or before reading the log).
+        """
+        self._flush_in_background()
+        if self._flushes:
+            await asyncio.wait(set(self._flushes))
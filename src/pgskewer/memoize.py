@@ -0,0 +1,59 @@
+"""
+Memoization of deterministic entrypoints: skip running a job when the same input was processed before.
+
+Results are cached in the `pgskewer_memo_cache` table (see `pgskewer_memo_cache_001`), keyed by entrypoint
+and a hash of the (relevant part of the) job's input.
+"""
+
+import dataclasses as dc
+import datetime as dt
+import hashlib
+import typing as t
+
+from .codecs import dumps_json
+
+
+def pipeline_input(payload: t.Any) -> t.Any:
+    """
+    The default memoization key: the part of a payload that determines the outcome of a deterministic step.
+
+    For pipeline substeps, that's the initial pipeline input, the results of earlier steps and the map element(s),
+    but not the metadata that differs between runs (pipeline name, job ids of references, task statuses).
+    Other payloads are used as-is.
+    """
+    if not isinstance(payload, dict) or not {"initial", "pipeline", "tasks"} <= payload.keys():
+        return payload
+
+    return {
+        "initial": payload["initial"],
+        "tasks": {step: task.get("result") for step, task in payload["tasks"].items()},
+        "map": payload.get("map"),
+    }
+
+
+@dc.dataclass(frozen=True)
+class Memoize:
+    """
+    Memoization policy of an entrypoint (`pgq.entrypoint(..., memoize=Memoize(...))`).
+
+    Attributes:
+        ttl: How long a cached result stays valid.
+        max_entries: How many results of this entrypoint are kept at most; the least recently used ones are evicted.
+            None means no limit (besides the ttl).
+        key: Selects the part of the (parsed) payload that the result depends on.
+            Defaults to `pipeline_input`; narrow it down when a step only uses part of its input, so runs that
+            differ in unrelated upstream results still hit the cache.
+
+    Example:
+        >>> @pgq.entrypoint("thumbnail", memoize=Memoize(ttl=dt.timedelta(days=7), key=lambda p: p["initial"]["url"]))
+    """
+
+    ttl: dt.timedelta = dt.timedelta(days=1)
+    max_entries: int | None = 10_000
+    key: t.Callable[[t.Any], t.Any] = pipeline_input
+
+    def input_hash(self, payload: t.Any) -> str:
+        """
+        Hash the relevant input of a (parsed) payload, independent of the order of dict keys.
+        """
+        return hashlib.sha256(dumps_json(self.key(payload), default=str, sort_keys=True).encode()).hexdigest()
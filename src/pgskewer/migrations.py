@@ -260,6 +260,401 @@ def pgskewer_results_durability_001(db: DAL):
     return True
 
 
+@migration()
+def pgskewer_notify_results_001(db: DAL):
+    # wake up `ImprovedQueuer.result()` waiters instead of letting them poll pgqueuer_result;
+    # one notification per statement (chunked to stay below the 8000 byte payload limit),
+    # containing a JSON list of the job ids that got a result.
+    db.executesql("""
+    CREATE FUNCTION fn_pgskewer_result_inserted() RETURNS TRIGGER AS $$
+    BEGIN
+        PERFORM pg_notify('ch_pgskewer_result', chunk.job_ids::text)
+        FROM (
+            SELECT json_agg(job_id) AS job_ids
+            FROM (SELECT job_id, (row_number() OVER () - 1) / 500 AS chunk_no FROM inserted) AS numbered
+            GROUP BY chunk_no
+        ) AS chunk;
+
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER tg_pgskewer_result_inserted
+    AFTER INSERT ON pgqueuer_result
+    REFERENCING NEW TABLE AS inserted
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION fn_pgskewer_result_inserted();
+    """)
+    db.commit()
+    return True
+
+
+@migration()
+def pgskewer_pipeline_checkpoint_001(db: DAL):
+    # progress of resumable pipelines (`pipeline(resumable=True)`), keyed by the pipeline job's dedupe_key
+    db.executesql("""
+    CREATE UNLOGGED TABLE pgskewer_pipeline_checkpoint (
+        unique_key TEXT PRIMARY KEY,
+        job_id     BIGINT                   NOT NULL,
+        entrypoint TEXT                     NOT NULL,
+        state      JSONB                    NOT NULL,
+        updated    TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+    );
+    """)
+    db.commit()
+    return True
+
+
+@migration()
+def pgskewer_detached_pipelines_001(db: DAL):
+    # detached pipeline runs (`pipeline(detached=True)`) live in the checkpoint table,
+    # owned by the worker executing them, which keeps `updated` fresh as heartbeat
+    db.executesql("""
+    ALTER TABLE pgskewer_pipeline_checkpoint
+        ADD COLUMN detached BOOLEAN NOT NULL DEFAULT FALSE,
+        ADD COLUMN owner    UUID;
+
+    CREATE INDEX idx_pgskewer_pipeline_checkpoint_detached ON pgskewer_pipeline_checkpoint (updated) WHERE detached;
+    """)
+    db.commit()
+    return True
+
+
+@migration()
+def pgskewer_memo_cache_001(db: DAL):
+    # cached results of memoized entrypoints (`pgq.entrypoint(..., memoize=True)`)
+    db.executesql("""
+    CREATE TABLE pgskewer_memo_cache (
+        entrypoint TEXT                     NOT NULL,
+        input_hash TEXT                     NOT NULL,
+        result     JSONB,
+        created    TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+        last_used  TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+        expires    TIMESTAMP WITH TIME ZONE NOT NULL,
+        PRIMARY KEY (entrypoint, input_hash)
+    );
+
+    -- for size-based eviction (least recently used first):
+    CREATE INDEX idx_pgskewer_memo_cache_last_used ON pgskewer_memo_cache (entrypoint, last_used);
+    """)
+    db.commit()
+    return True
+
+
+@migration()
+def pgskewer_partition_results_001(db: DAL):
+    # `pgqueuer_result` only grew (vacuum is practically off) and had no indexes, so every `result()` lookup
+    # was a sequential scan over all results ever stored. Results are now indexed and partitioned by day,
+    # so old results can be removed by dropping whole partitions (see `pgskewer_maintain_results`).
+    # A partitioned table can't be UNLOGGED itself (pg < 18), so its partitions are.
+    db.executesql("""
+    ALTER TABLE pgqueuer_result RENAME TO pgqueuer_result_unpartitioned;
+    ALTER TABLE pgqueuer_result_unpartitioned
+        RENAME CONSTRAINT pgqueuer_result_pkey TO pgqueuer_result_unpartitioned_pkey;
+    DROP TRIGGER tg_pgskewer_result_inserted ON pgqueuer_result_unpartitioned;
+
+    CREATE TABLE pgqueuer_result (
+        id           BIGINT          NOT NULL DEFAULT nextval('pgqueuer_result_id_seq'),
+        job_id       BIGINT          NOT NULL,
+        entrypoint   TEXT            NOT NULL,
+        status       pgqueuer_status NOT NULL,
+        ok           BOOLEAN                  DEFAULT TRUE,
+        result       JSON            NOT NULL,
+        completed_at TIMESTAMP       NOT NULL DEFAULT NOW(),
+        unique_key   UUID            NOT NULL, -- pgskewer uses UUID7
+        PRIMARY KEY (id, completed_at)
+    ) PARTITION BY RANGE (completed_at);
+
+    ALTER SEQUENCE pgqueuer_result_id_seq AS BIGINT OWNED BY pgqueuer_result.id;
+
+    CREATE INDEX idx_pgqueuer_result_job_id ON pgqueuer_result (job_id);
+    CREATE INDEX idx_pgqueuer_result_unique_key ON pgqueuer_result (unique_key);
+
+    CREATE TRIGGER tg_pgskewer_result_inserted
+    AFTER INSERT ON pgqueuer_result
+    REFERENCING NEW TABLE AS inserted
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION fn_pgskewer_result_inserted();
+
+    -- create the partitions for today and the coming days, and drop the ones that are past their retention.
+    -- called by every worker (`ImprovedQueuer.maintain_results`), but can be scheduled elsewhere (e.g. pg_cron) too.
+    -- new partitions are attached instead of created with PARTITION OF, which would lock out readers of the table.
+    -- dropping a partition does need an exclusive lock; when the table is busy, that's retried next time
+    -- instead of making all readers and writers queue up behind it.
+    CREATE FUNCTION pgskewer_maintain_results(retention INTERVAL DEFAULT NULL, days_ahead INTEGER DEFAULT 7)
+    RETURNS VOID AS $$
+    DECLARE
+        day       TIMESTAMP;
+        partition TEXT;
+    BEGIN
+        PERFORM pg_advisory_xact_lock(hashtext('pgskewer_maintain_results'));
+
+        FOR day IN
+            SELECT generate_series(
+                date_trunc('day', LOCALTIMESTAMP),
+                date_trunc('day', LOCALTIMESTAMP) + days_ahead * INTERVAL '1 day',
+                INTERVAL '1 day'
+            )
+        LOOP
+            partition := 'pgqueuer_result_' || to_char(day, 'YYYYMMDD');
+            IF to_regclass(partition) IS NULL THEN
+                EXECUTE format('CREATE UNLOGGED TABLE %I (LIKE pgqueuer_result INCLUDING DEFAULTS)', partition);
+                EXECUTE format(
+                    'ALTER TABLE pgqueuer_result ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                    partition, day, day + INTERVAL '1 day'
+                );
+            END IF;
+        END LOOP;
+
+        IF retention IS NULL THEN
+            RETURN;
+        END IF;
+
+        PERFORM set_config('lock_timeout', '1s', TRUE);
+
+        FOR partition IN
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = 'pgqueuer_result'::regclass
+              AND substring(pg_get_expr(child.relpartbound, child.oid) FROM $re$TO \\('([^']+)'\\)$re$)::TIMESTAMP
+                  <= LOCALTIMESTAMP - retention
+        LOOP
+            BEGIN
+                EXECUTE format('DROP TABLE %I', partition);
+            EXCEPTION WHEN lock_not_available THEN
+                RAISE NOTICE '% is in use, dropping it next time', partition;
+            END;
+        END LOOP;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    -- existing results go into a single partition, which is dropped as a whole once it's past the retention period:
+    DO $$
+    DECLARE
+        oldest TIMESTAMP := (SELECT date_trunc('day', min(completed_at)) FROM pgqueuer_result_unpartitioned);
+    BEGIN
+        IF oldest < date_trunc('day', LOCALTIMESTAMP) THEN
+            EXECUTE format(
+                'CREATE UNLOGGED TABLE pgqueuer_result_history PARTITION OF pgqueuer_result '
+                'FOR VALUES FROM (MINVALUE) TO (%L)',
+                date_trunc('day', LOCALTIMESTAMP)
+            );
+        END IF;
+    END;
+    $$;
+
+    SELECT pgskewer_maintain_results();
+
+    INSERT INTO pgqueuer_result
+    SELECT *
+    FROM pgqueuer_result_unpartitioned;
+
+    DROP TABLE pgqueuer_result_unpartitioned;
+    """)
+    db.commit()
+    return True
+
+
+@migration()
+def pgskewer_result_blobs_001(db: DAL):
+    # large results, stored compressed outside of `pgqueuer_result` (see `pgskewer.results`).
+    # the data is compressed already, so postgres shouldn't try again: EXTERNAL storage also makes reading
+    # a slice of it (`substring`, used to stream a blob) only fetch the chunks it needs.
+    db.executesql("""
+    CREATE UNLOGGED TABLE pgskewer_result_blob (
+        id          UUID      PRIMARY KEY, -- pgskewer uses UUID7
+        compression TEXT      NOT NULL,
+        size        BIGINT    NOT NULL,    -- uncompressed
+        data        BYTEA     NOT NULL,
+        created     TIMESTAMP NOT NULL DEFAULT NOW()
+    );
+
+    ALTER TABLE pgskewer_result_blob ALTER COLUMN data SET STORAGE EXTERNAL;
+
+    -- for retention:
+    CREATE INDEX idx_pgskewer_result_blob_created ON pgskewer_result_blob (created);
+    """)
+    db.commit()
+    return True
+
+
+@migration()
+def pgskewer_log_rollup_001(db: DAL):
+    # `pgqueuer_log` is rolled up incrementally (see `pgskewer_rollup_log`, called by every worker):
+    # - counts per second go into `pgqueuer_statistics` (like `pgq dashboard` does, but in bounded batches)
+    # - durations (from 'picked' to done) per minute go into a histogram in `pgskewer_log_durations`,
+    #   which (unlike percentiles) can be added up across batches and time ranges.
+    # bucket `n` holds the durations between 2^(n/4) and 2^((n+1)/4) milliseconds (~19% wide, up to ~9 hours).
+    db.executesql("""
+    CREATE UNLOGGED TABLE pgskewer_log_durations (
+        minute     TIMESTAMP WITH TIME ZONE NOT NULL,
+        entrypoint TEXT                     NOT NULL,
+        status     pgqueuer_status          NOT NULL,
+        bucket     SMALLINT                 NOT NULL,
+        count      BIGINT                   NOT NULL,
+        PRIMARY KEY (minute, entrypoint, status, bucket)
+    );
+
+    -- returns how many log entries were rolled up: call it again until that's less than `batch_size`.
+    CREATE FUNCTION pgskewer_rollup_log(batch_size INTEGER DEFAULT 10000, retention INTERVAL DEFAULT NULL)
+    RETURNS INTEGER AS $$
+    DECLARE
+        rolled_up INTEGER;
+    BEGIN
+        IF NOT pg_try_advisory_xact_lock(hashtext('pgskewer_rollup_log')) THEN
+            RETURN 0; -- another worker is at it
+        END IF;
+
+        WITH claimed AS (
+            UPDATE pgqueuer_log
+            SET aggregated = TRUE
+            WHERE id IN (SELECT id FROM pgqueuer_log WHERE NOT aggregated LIMIT batch_size)
+            RETURNING created, job_id, status, priority, entrypoint
+        ),
+        counted AS (
+            INSERT INTO pgqueuer_statistics (count, created, entrypoint, priority, status)
+            SELECT COUNT(*), date_trunc('sec', created), entrypoint, priority, status
+            FROM claimed
+            GROUP BY date_trunc('sec', created), entrypoint, priority, status
+            ON CONFLICT (priority, date_trunc('sec', created AT TIME ZONE 'UTC'), status, entrypoint)
+            DO UPDATE SET count = pgqueuer_statistics.count + EXCLUDED.count
+        ),
+        timed AS (
+            INSERT INTO pgskewer_log_durations (minute, entrypoint, status, bucket, count)
+            SELECT date_trunc('minute', claimed.created), claimed.entrypoint, claimed.status, bucket, COUNT(*)
+            FROM claimed
+            CROSS JOIN LATERAL (
+                SELECT MAX(picked.created) AS created
+                FROM pgqueuer_log AS picked
+                WHERE picked.job_id = claimed.job_id
+                  AND picked.status = 'picked'
+                  AND picked.created <= claimed.created
+            ) AS picked
+            CROSS JOIN LATERAL (
+                SELECT LEAST(99, GREATEST(0, FLOOR(4 * LOG(2, GREATEST(
+                    1, EXTRACT(EPOCH FROM claimed.created - picked.created) * 1000
+                )::NUMERIC))))::SMALLINT AS bucket
+            ) AS duration
+            WHERE claimed.status IN ('successful', 'exception', 'canceled')
+              AND picked.created IS NOT NULL
+            GROUP BY 1, 2, 3, 4
+            ON CONFLICT (minute, entrypoint, status, bucket)
+            DO UPDATE SET count = pgskewer_log_durations.count + EXCLUDED.count
+        )
+        SELECT COUNT(*) INTO rolled_up FROM claimed;
+
+        IF retention IS NOT NULL THEN
+            DELETE FROM pgqueuer_log
+            WHERE id IN (
+                SELECT id FROM pgqueuer_log WHERE aggregated AND created < NOW() - retention LIMIT batch_size
+            );
+            DELETE FROM pgskewer_log_durations WHERE minute < NOW() - retention;
+        END IF;
+
+        RETURN rolled_up;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    -- duration percentiles per entrypoint and status, since some time (e.g. NOW() - INTERVAL '1 hour').
+    -- a percentile is the upper bound of the histogram bucket it falls in.
+    CREATE FUNCTION pgskewer_log_duration_percentiles(since TIMESTAMP WITH TIME ZONE)
+    RETURNS TABLE (entrypoint TEXT, status pgqueuer_status, count BIGINT, p50 INTERVAL, p95 INTERVAL, p99 INTERVAL)
+    AS $$
+        WITH buckets AS (
+            SELECT entrypoint, status, bucket, SUM(count) AS count
+            FROM pgskewer_log_durations
+            WHERE minute >= date_trunc('minute', since)
+            GROUP BY entrypoint, status, bucket
+        ),
+        cumulative AS (
+            SELECT entrypoint, status, bucket,
+                   SUM(count) OVER (PARTITION BY entrypoint, status ORDER BY bucket) AS seen,
+                   SUM(count) OVER (PARTITION BY entrypoint, status) AS total
+            FROM buckets
+        )
+        SELECT entrypoint, status, MAX(total)::BIGINT,
+               MIN(make_interval(secs => 2 ^ ((bucket + 1) / 4.0) / 1000)) FILTER (WHERE seen >= 0.50 * total),
+               MIN(make_interval(secs => 2 ^ ((bucket + 1) / 4.0) / 1000)) FILTER (WHERE seen >= 0.95 * total),
+               MIN(make_interval(secs => 2 ^ ((bucket + 1) / 4.0) / 1000)) FILTER (WHERE seen >= 0.99 * total)
+        FROM cumulative
+        GROUP BY entrypoint, status
+        ORDER BY entrypoint, status;
+    $$ LANGUAGE sql STABLE;
+    """)
+    db.commit()
+    return True
+
+
+@migration()
+def pgskewer_result_default_partition_001(db: DAL):
+    # without a partition for the current day (e.g. when no worker ran maintenance for a week), storing results failed.
+    # those now land in a DEFAULT partition, and maintenance moves them into the partition of their day once it exists.
+    # (the DEFAULT partition has no upper bound, so the retention query never drops it.)
+    db.executesql("""
+    CREATE UNLOGGED TABLE pgqueuer_result_default PARTITION OF pgqueuer_result DEFAULT;
+
+    CREATE OR REPLACE FUNCTION pgskewer_maintain_results(retention INTERVAL DEFAULT NULL, days_ahead INTEGER DEFAULT 7)
+    RETURNS VOID AS $$
+    DECLARE
+        day       TIMESTAMP;
+        partition TEXT;
+    BEGIN
+        PERFORM pg_advisory_xact_lock(hashtext('pgskewer_maintain_results'));
+
+        FOR day IN
+            SELECT generate_series(
+                date_trunc('day', LOCALTIMESTAMP),
+                date_trunc('day', LOCALTIMESTAMP) + days_ahead * INTERVAL '1 day',
+                INTERVAL '1 day'
+            )
+            UNION
+            SELECT DISTINCT date_trunc('day', completed_at) FROM pgqueuer_result_default
+        LOOP
+            partition := 'pgqueuer_result_' || to_char(day, 'YYYYMMDD');
+            IF to_regclass(partition) IS NULL THEN
+                EXECUTE format('CREATE UNLOGGED TABLE %I (LIKE pgqueuer_result INCLUDING DEFAULTS)', partition);
+                -- attaching fails while the DEFAULT partition holds rows of that day, so move those over first:
+                EXECUTE format(
+                    'WITH moved AS ('
+                    '    DELETE FROM pgqueuer_result_default WHERE completed_at >= %L AND completed_at < %L RETURNING *'
+                    ') INSERT INTO %I SELECT * FROM moved',
+                    day, day + INTERVAL '1 day', partition
+                );
+                EXECUTE format(
+                    'ALTER TABLE pgqueuer_result ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                    partition, day, day + INTERVAL '1 day'
+                );
+            END IF;
+        END LOOP;
+
+        IF retention IS NULL THEN
+            RETURN;
+        END IF;
+
+        PERFORM set_config('lock_timeout', '1s', TRUE);
+
+        FOR partition IN
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = 'pgqueuer_result'::regclass
+              AND substring(pg_get_expr(child.relpartbound, child.oid) FROM $re$TO \\('([^']+)'\\)$re$)::TIMESTAMP
+                  <= LOCALTIMESTAMP - retention
+        LOOP
+            BEGIN
+                EXECUTE format('DROP TABLE %I', partition);
+            EXCEPTION WHEN lock_not_available THEN
+                RAISE NOTICE '% is in use, dropping it next time', partition;
+            END;
+        END LOOP;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+    db.commit()
+    return True
+
+
 def noop():
     """
     You just need to import this file, but if your editor complains that your import is useless,
@@ -0,0 +1,207 @@
+"""
+Batched ("group commit") storage of job results in `pgqueuer_result`.
+
+Large results can be offloaded: they're stored compressed in `pgskewer_result_blob`,
+and `pgqueuer_result` only holds a small pointer to them (see `ResultWriter.blob_threshold`).
+
+Compression:
+- `zstd`: only available when `zstandard` is installed
+- `zlib`: always available, used when `zstandard` is missing
+"""
+
+import asyncio
+import dataclasses as dc
+import datetime as dt
+import typing as t
+import uuid
+import zlib
+
+from edwh_uuid7 import uuid7
+from pgqueuer import db
+
+from .codecs import dumps_json
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+type ResultRow = tuple[int, str, str, bool, str, str]
+# (id, compression, size, compressed data):
+type BlobRow = tuple[str, str, int, bytes]
+# a buffered result, with the future its writer waits for:
+type PendingResult = tuple[ResultRow, BlobRow | None, asyncio.Future[None]]
+
+
+class Decompressor(t.Protocol):
+    def decompress(self, data: bytes) -> bytes: ...
+
+    def flush(self) -> bytes: ...
+
+
+# compression name -> (compress, create a streaming decompressor):
+COMPRESSION: dict[str, tuple[t.Callable[[bytes], bytes], t.Callable[[], Decompressor]]] = {
+    "zlib": (zlib.compress, zlib.decompressobj),
+}
+
+if zstandard is not None:  # pragma: no cover
+    COMPRESSION["zstd"] = (
+        lambda data: zstandard.ZstdCompressor().compress(data),
+        lambda: zstandard.ZstdDecompressor().decompressobj(),
+    )
+
+DEFAULT_COMPRESSION = "zstd" if "zstd" in COMPRESSION else "zlib"
+
+# key that marks a (JSON) result as a pointer to an offloaded blob:
+BLOB_KEY = "$pgskewer_blob"
+
+BlobPointer = t.TypedDict("BlobPointer", {"$pgskewer_blob": str, "compression": str, "size": int})
+
+
+def is_blob(value: t.Any) -> t.TypeGuard[BlobPointer]:
+    """
+    Whether a (parsed) result is a pointer to an offloaded blob, instead of the result itself.
+    """
+    return isinstance(value, dict) and BLOB_KEY in value
+
+
+@dc.dataclass
+class ResultWriter:
+    """
+    Collects the results of concurrently finishing jobs and stores them with a single multi-row insert.
+
+    Storing every result with its own INSERT makes the (shared) connection the throughput ceiling under bursty load.
+    `write()` adds a result to a buffer, which is flushed once it holds `max_rows` results or `max_delay` after
+    the first result was added, whichever comes first. `write()` only returns once its result is stored,
+    so a job still finishes after its result exists, and `result()` waiters are notified right after each flush.
+    When a batch can't be stored, its results are retried one by one, so only the writers of bad results get an error.
+
+    Results that are larger than `blob_threshold` bytes (as JSON) are compressed and stored in
+    `pgskewer_result_blob`; their row in `pgqueuer_result` only holds a `BlobPointer`.
+    That keeps the result table small, and pipelines pass the pointer on instead of copying the result
+    into every later payload.
+
+    Example:
+        >>> writer = ResultWriter(driver)
+        >>> await writer.write(job.id, job.entrypoint, {"processed": True}, True, "successful", unique_key)
+        >>> await writer.flush()  # on shutdown
+    """
+
+    driver: db.Driver
+    max_delay: dt.timedelta = dt.timedelta(milliseconds=5)
+    max_rows: int = 500
+    blob_threshold: int | None = None
+    compression: str = DEFAULT_COMPRESSION
+
+    _buffer: list[PendingResult] = dc.field(default_factory=list, init=False, repr=False)
+    _timer: asyncio.Task[None] | None = dc.field(default=None, init=False, repr=False)
+    _flushes: set[asyncio.Task[None]] = dc.field(default_factory=set, init=False, repr=False)
+
+    async def write(
+        self,
+        job_id: int,
+        entrypoint: str,
+        result: t.Any,
+        ok: bool,
+        status: str,
+        unique_key: str | uuid.UUID | None,
+    ) -> None:
+        """
+        Store the result of a job, together with the results of other jobs that finish around the same time.
+
+        Raises:
+            ValueError: if `unique_key` (the unique key of the job) is missing or not a UUID
+                (checked upfront, so it can't fail the rest of the batch).
+        """
+        if not unique_key:
+            raise ValueError(f"can't store the result of job {job_id} ({entrypoint}) without its unique key")
+        key = str(uuid.UUID(str(unique_key)))
+        encoded = dumps_json(result, default=str)
+
+        blob: BlobRow | None = None
+        if self.blob_threshold is not None and len(encoded) > self.blob_threshold:
+            data = encoded.encode()
+            compress, _ = COMPRESSION[self.compression]
+            blob = (str(uuid7()), self.compression, len(data), await asyncio.to_thread(compress, data))
+            encoded = dumps_json({BLOB_KEY: blob[0], "compression": blob[1], "size": blob[2]})
+
+        done: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self._buffer.append(((job_id, entrypoint, encoded, ok, status, key), blob, done))
+
+        if len(self._buffer) >= self.max_rows:
+            flush = asyncio.create_task(self.flush())
+            self._flushes.add(flush)
+            flush.add_done_callback(self._flushes.discard)
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+        await asyncio.shield(done)
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.max_delay.total_seconds())
+        self._timer = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        """
+        Store all buffered results now (e.g. on shutdown).
+        """
+        if self._timer is not None and self._timer is not asyncio.current_task():
+            self._timer.cancel()
+        self._timer = None
+
+        batch, self._buffer = self._buffer, []
+        if not batch:
+            return
+
+        error = await self._store(batch)
+        if error is not None and len(batch) > 1:
+            # one bad result (e.g. a NaN, which `json` rejects) shouldn't fail the others: retry them one by one
+            for entry in batch:
+                _settle([entry], await self._store([entry]))
+        else:
+            _settle(batch, error)
+
+    async def _store(self, batch: list[PendingResult]) -> Exception | None:
+        """
+        Insert a batch of results (and their blobs), returning the error if that failed.
+        """
+        rows = [row for row, _, _ in batch]
+        blobs = [blob for _, blob, _ in batch if blob is not None]
+        try:
+            if blobs:
+                # before the pointers to them (and idempotent, in case the batch is retried row by row):
+                await self.driver.execute(
+                    """
+                    INSERT INTO pgskewer_result_blob (id, compression, size, data)
+                    SELECT *
+                    FROM unnest($1::uuid[], $2::text[], $3::bigint[], $4::bytea[])
+                    ON CONFLICT (id) DO NOTHING;
+                    """,
+                    *map(list, zip(*blobs)),
+                )
+
+            await self.driver.execute(
+                """
+                INSERT INTO pgqueuer_result (job_id, entrypoint, result, ok, status, unique_key)
+                SELECT *
+                FROM unnest($1::bigint[], $2::text[], $3::json[], $4::bool[], $5::pgqueuer_status[], $6::uuid[]);
+                """,
+                *map(list, zip(*rows)),
+            )
+        except Exception as e:  # noqa: BLE001 - handed to the writers waiting for these results, to raise there
+            return e
+        return None
+
+
+def _settle(batch: list[PendingResult], error: Exception | None) -> None:
+    """
+    Let the writers waiting for a batch know whether their results were stored.
+    """
+    for _, _, done in batch:
+        if done.done():
+            continue
+        if error is not None:
+            done.set_exception(error)
+        else:
+            done.set_result(None)
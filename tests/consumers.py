@@ -3,7 +3,7 @@ import datetime
 
 from edwh_migrate import activate_migrations
 
-from pgskewer import ImprovedQueuer, Job, parse_payload
+from pgskewer import Group, ImprovedQueuer, Job, Step, parse_payload
 from pgskewer.migrations import noop
 
 
@@ -11,7 +11,8 @@ async def main():
     noop()
     activate_migrations()
 
-    pgq = await ImprovedQueuer.from_env()
+    pgq = await ImprovedQueuer.from_env(pool_size=4)
+    pgq.result_writer.blob_threshold = 100_000
 
     @pgq.entrypoint("basic")
     async def basic_entrypoint(job: Job):
@@ -27,7 +28,8 @@ async def main():
 
     @pgq.entrypoint("dill")
     async def dill_entrypoint(job: Job):
-        data = parse_payload(job.payload)
+        assert job.headers == {"codec": "dill", "unique_key": job.headers["unique_key"]}
+        data = parse_payload(job)
 
         assert isinstance(data, dict), "dat should be a dict"
 
@@ -92,6 +94,9 @@ async def main():
 
     pgq.entrypoint_pipeline("pull_apart_song", pull_apart_song_step)
     pgq.entrypoint_pipeline("download_and_pull_apart_song", download_url_audio, "pull_apart_song")
+    pgq.entrypoint_pipeline(
+        "download_and_pull_apart_song_unflattened", download_url_audio, "pull_apart_song", flatten=False
+    )
 
     @pgq.entrypoint("access_pipeline")
     async def access_pipeline(job: Job):
@@ -105,5 +110,189 @@ async def main():
 
     pgq.entrypoint_pipeline("meta_pipeline", access_pipeline, [access_pipeline, access_pipeline])
 
+    @pgq.entrypoint("after_basic")
+    async def after_basic(job: Job):
+        payload = parse_payload(job.payload)
+        assert payload["tasks"]["basic"]["ok"]
+        assert "slow_non_cancelable" not in payload["tasks"]
+        return True
+
+    pgq.entrypoint_pipeline(
+        "dag_pipeline",
+        {
+            basic_entrypoint: [],
+            slow_non_cancelable: basic_entrypoint,
+            after_basic: [basic_entrypoint],
+        },
+    )
+
+    @pgq.entrypoint("read_reference")
+    async def read_reference(job: Job):
+        payload = parse_payload(job.payload)
+
+        assert payload["tasks"] == {}, "results should only be passed by reference"
+        assert set(payload["refs"]) == {"basic"}
+
+        basic = await pgq.task_result(payload, "basic")
+        return basic["result"]
+
+    pgq.entrypoint_pipeline("reference_pipeline", basic_entrypoint, read_reference, by_reference=True)
+    pgq.entrypoint_pipeline("reference_parent", "reference_pipeline")
+
+    pgq.entrypoint_pipeline("resumable_pipeline", [basic_entrypoint, slow_cancelable], after_basic, resumable=True)
+
+    @pgq.entrypoint("square")
+    async def square(job: Job):
+        payload = parse_payload(job.payload)
+        return payload["map"]["item"] ** 2
+
+    @pgq.entrypoint("square_chunk")
+    async def square_chunk(job: Job):
+        payload = parse_payload(job.payload)
+        return [item**2 for item in payload["map"]["items"]]
+
+    @pgq.entrypoint("sum_squares")
+    async def sum_squares(job: Job):
+        payload = parse_payload(job.payload)
+        squares = payload["tasks"]["square"]["result"]
+        chunked = payload["tasks"]["square_chunk"]["result"]
+
+        assert squares == [square for chunk in chunked for square in chunk]
+        return sum(squares)
+
+    # planning the map step fails (there's nothing to map over) while slow_cancelable is still running:
+    pgq.entrypoint_pipeline(
+        "failing_map_pipeline",
+        {
+            basic_entrypoint: [],
+            slow_cancelable: [],
+            Step(square, over="initial.missing"): [basic_entrypoint],
+        },
+    )
+
+    pgq.entrypoint_pipeline(
+        "map_pipeline",
+        [
+            Step(square, over="initial.numbers"),
+            Step(square_chunk, over=lambda payload: payload["initial"]["numbers"], chunk_size=2),
+        ],
+        sum_squares,
+    )
+
+    @pgq.entrypoint("flaky")
+    async def flaky(job: Job):
+        # fails twice for every token, then succeeds
+        token = parse_payload(job.payload)["initial"]["token"]
+        rows = await pgq.connection.fetch(
+            """
+            SELECT COUNT(*) AS failures
+            FROM pgqueuer_result
+            WHERE entrypoint = 'flaky' AND result -> 'exception' ->> 1 = $1
+            """,
+            token,
+        )
+        if rows[0]["failures"] < 2:
+            raise ConnectionError(token)
+        return rows[0]["failures"]
+
+    pgq.entrypoint_pipeline("retry_pipeline", Step(flaky, retries=2, backoff=0.1, retry_on=[ConnectionError]))
+    pgq.entrypoint_pipeline("no_retry_pipeline", Step(flaky, retries=2, backoff=0.1, retry_on=["KeyError"]))
+    pgq.entrypoint_pipeline("resumable_retry_pipeline", Step(flaky, retries=1, backoff=0.1), resumable=True)
+    pgq.entrypoint_pipeline("timeout_pipeline", Step(slow_cancelable, timeout=1))
+
+    @pgq.entrypoint("slow_double", memoize=True)
+    async def slow_double(job: Job):
+        payload = parse_payload(job.payload)
+        await asyncio.sleep(1)
+        return payload["initial"]["number"] * 2
+
+    pgq.entrypoint_pipeline("memo_pipeline", slow_double, basic_entrypoint)
+
+    @pgq.entrypoint("glue", inline=True)
+    async def glue(job: Job):
+        payload = parse_payload(job)
+        return {"basic": payload["tasks"]["basic"]["result"], "job_id": job.id}
+
+    @pgq.entrypoint("inline_failing", inline=True)
+    async def inline_failing(job: Job):
+        raise KeyError("inline")
+
+    @pgq.entrypoint("inline_unstored", inline=True, store_results=False, cancelable=False)
+    async def inline_unstored(job: Job):
+        return job.id
+
+    pgq.entrypoint_pipeline("inline_pipeline", basic_entrypoint, glue, after_basic)
+    pgq.entrypoint_pipeline("inline_unstored_pipeline", basic_entrypoint, inline_unstored, after_basic)
+    pgq.entrypoint_pipeline("inline_failing_pipeline", basic_entrypoint, inline_failing, after_basic)
+
+    pgq.detached_heartbeat = datetime.timedelta(seconds=1)
+    pgq.entrypoint_pipeline(
+        "detached_pipeline",
+        basic_entrypoint,
+        [slow_cancelable, slow_non_cancelable],
+        detached=True,
+    )
+    pgq.entrypoint_pipeline("detached_parent", "detached_pipeline", basic_entrypoint)
+    pgq.entrypoint_pipeline("failing_detached_pipeline", basic_entrypoint, failing_entrypoint, detached=True)
+    pgq.entrypoint_pipeline("timeout_detached_pipeline", Step(slow_cancelable, timeout=1), detached=True)
+
+    @pgq.entrypoint("large_result")
+    async def large_result(job: Job):
+        return "x" * 200_000
+
+    @pgq.entrypoint("read_large_result")
+    async def read_large_result(job: Job):
+        payload = parse_payload(job.payload)
+        assert "$pgskewer_blob" in payload["tasks"]["large_result"]["result"], "large results are passed as pointer"
+
+        large = await pgq.task_result(payload, "large_result")
+        return len(large["result"])
+
+    pgq.entrypoint_pipeline("large_result_pipeline", large_result, read_large_result)
+
+    @pgq.entrypoint("large_items")
+    async def large_items(job: Job):
+        return [letter * 50_000 for letter in "xyz"]
+
+    @pgq.entrypoint("item_length")
+    async def item_length(job: Job):
+        return len(parse_payload(job.payload)["map"]["item"])
+
+    @pgq.entrypoint("chunk_lengths")
+    async def chunk_lengths(job: Job):
+        return [len(item) for item in parse_payload(job.payload)["map"]["items"]]
+
+    @pgq.entrypoint("count_large_items", memoize=True)
+    async def count_large_items(job: Job):
+        large = await pgq.task_result(parse_payload(job.payload), "large_items")
+        return len(large["result"])
+
+    pgq.entrypoint_pipeline(
+        "large_map_pipeline",
+        large_items,
+        [
+            Step(item_length, over="tasks.large_items.result"),
+            Step(chunk_lengths, over=lambda payload: payload["tasks"]["large_items"]["result"], chunk_size=2),
+        ],
+        count_large_items,
+    )
+
+    pgq.entrypoint_pipeline("priority_pipeline", basic_entrypoint, after_basic, completion_boost=10)
+
+    pgq.entrypoint_pipeline("slow_nested_pipeline", basic_entrypoint, slow_cancelable)
+    pgq.entrypoint_pipeline("cancel_tree_pipeline", "slow_nested_pipeline", flatten=False)
+
+    pgq.entrypoint_pipeline(
+        "windowed_pipeline",
+        Group(
+            [
+                Step(square, over="initial.numbers", max_parallel=2),
+                Step(square_chunk, over="initial.numbers", chunk_size=2),
+            ],
+            max_parallel=3,
+        ),
+        sum_squares,
+    )
+
     print("listening", pgq.channel)
     return pgq
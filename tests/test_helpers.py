@@ -1,9 +1,25 @@
 import asyncio
+import datetime
+import json
+import math
 
 import pytest
 from typedal import TypeDAL
 
-from src.pgskewer import safe_json, unblock
+from src.pgskewer import (
+    PipelineDefinition,
+    PlanStep,
+    Step,
+    _flatten_plan,
+    _plan_graph,
+    _plan_stages,
+    codecs,
+    parse_payload,
+    safe_json,
+    unblock,
+)
+from src.pgskewer.codecs import dumps_json, encode_payload, get_codec, loads_json, payload_codec
+from src.pgskewer.memoize import Memoize
 
 pytestmark = pytest.mark.anyio
 
@@ -15,6 +31,113 @@ def test_safe_json():
     assert safe_json(None) is None
 
 
+def test_plan_graph():
+    plan = _plan_graph({"load": ["transform"], "transform": ["extract"], "report": ["extract"]})
+    order = [node.entrypoint for node in plan]
+
+    assert order.index("extract") < order.index("transform") < order.index("load")
+    assert [order[dep] for dep in plan[order.index("load")].depends_on] == ["transform"]
+
+    with pytest.raises(ValueError, match="cycle"):
+        _plan_graph({"a": ["b"], "b": ["a"]})
+
+
+def test_map_units():
+    payload = {"initial": {"numbers": [1, 2, 3]}, "tasks": {}}
+
+    node = PlanStep("square", options=Step("square", over="initial.numbers"))
+    assert node.units(payload) == [{"index": 0, "item": 1}, {"index": 1, "item": 2}, {"index": 2, "item": 3}]
+
+    node = PlanStep("square", options=Step("square", over=lambda p: p["initial"]["numbers"], chunk_size=2))
+    assert node.units(payload) == [{"index": 0, "items": [1, 2]}, {"index": 1, "items": [3]}]
+
+    assert PlanStep("square").units(payload) == [None]
+
+    with pytest.raises(ValueError, match="map steps"):
+        Step("square", chunk_size=2)
+
+
+def test_flatten_plan():
+    child = PipelineDefinition(
+        _plan_stages(["split", ["left", "right"]]), {"name": "", "steps": ["split", ["left", "right"]]}
+    )
+    plan = _flatten_plan(_plan_stages(["download", "child", "report"]), {"child": child})
+
+    assert [node.entrypoint for node in plan] == ["download", "split", "left", "right", "child", "report"]
+    assert [node.depends_on for node in plan] == [(), (0,), (1,), (1,), (2, 3), (4,)]
+    assert plan[1].context == {"name": "child", "steps": ["split", ["left", "right"]]}
+    assert plan[4].collects == plan[1].context
+
+    # step names must stay unique, so a nested pipeline that clashes keeps its own job:
+    plan = _flatten_plan(_plan_stages(["split", "child"]), {"child": child})
+    assert [node.entrypoint for node in plan] == ["split", "child"]
+
+
+def test_memoize_input_hash():
+    policy = Memoize()
+    payload = {
+        "initial": {"a": 1, "b": 2},
+        "pipeline": {"name": "first", "steps": ["x", "y"]},
+        "tasks": {"x": {"status": "successful", "ok": True, "result": [1, 2]}},
+    }
+    # same input in another pipeline run (different metadata, different key order):
+    other_run = {
+        "initial": {"b": 2, "a": 1},
+        "pipeline": {"name": "second", "steps": ["x", "y"]},
+        "tasks": {"x": {"result": [1, 2], "ok": True, "status": "successful"}},
+        "refs": {"x": 123},
+    }
+
+    assert policy.input_hash(payload) == policy.input_hash(other_run)
+    assert policy.input_hash(payload) != policy.input_hash(payload | {"initial": {"a": 2, "b": 2}})
+
+    narrow = Memoize(key=lambda p: p["initial"]["a"])
+    assert narrow.input_hash(payload) == narrow.input_hash(payload | {"initial": {"a": 1, "b": 3}})
+
+
+def test_codecs():
+    data = {"key": ["value", 1]}
+
+    for name in ("json", "dill"):
+        payload, headers = encode_payload(data, name)
+        assert headers == {"codec": name}
+        assert payload_codec(payload, headers).decode(payload) == data
+
+    # untagged payloads are recognized without trying every decoder:
+    assert payload_codec(encode_payload(data, "dill")[0]).name == "dill"
+    assert payload_codec(b'{"key": "value"}').name == "json"
+    assert parse_payload(encode_payload(data, "dill")[0]) == data
+
+    with pytest.raises(ValueError, match="Unknown payload codec"):
+        get_codec("morse")
+
+
+def test_dumps_json(monkeypatch):
+    data = {
+        "big": 2**70,
+        "when": datetime.datetime(2024, 1, 2, 3, 4, 5),
+        "nan": float("nan"),
+        "nested": [None, 1.5, "ünïcode", {"inf": float("inf")}],
+    }
+    plain = {"when": datetime.datetime(2024, 1, 2, 3, 4, 5), "values": [None, True, 1.5]}
+
+    with_orjson = dumps_json(data, default=str), dumps_json(plain, default=str, sort_keys=True)
+    monkeypatch.setattr(codecs, "orjson", None)
+    without_orjson = dumps_json(data, default=str), dumps_json(plain, default=str, sort_keys=True)
+
+    assert with_orjson == without_orjson
+    assert with_orjson[1] == '{"values":[null,true,1.5],"when":"2024-01-02 03:04:05"}'
+    assert json.loads(with_orjson[0])["big"] == 2**70
+
+    # without `default`, unsupported types still raise:
+    with pytest.raises(TypeError):
+        dumps_json({"when": datetime.datetime.now()})
+
+    monkeypatch.undo()
+    assert loads_json(with_orjson[0])["big"] == 2**70
+    assert math.isnan(loads_json(with_orjson[0])["nan"])
+
+
 def time_blocker(duration):
     import time
 